@@ -1,3 +1,3 @@
 @echo off
-cd .. && python image_manager.py input output -compress dds
+cd .. && python image_manager.py input output -compress dds -dds bc3
 cd compress
\ No newline at end of file
@@ -0,0 +1,273 @@
+import struct
+import numpy as np
+from PIL import Image
+
+"""
+    BC1, BC3 and BC7 block compression and DDS writing with a full mipmap chain.
+    Every 4x4 block of a mip level is encoded at the same time with numpy: the endpoints are the ends of the
+    block's principal axis and every pixel gets the palette entry closest to its position on that axis.
+    BC7 blocks are always written in mode 6 (one subset, RGBA endpoints with 4 bit indices), which covers
+    portraits and icons well without searching the partitioned modes.
+
+    Usage: python dds_encoder.py input.png output.dds bc7
+"""
+
+DDS_MAGIC = b"DDS "
+DDSD_FLAGS = 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000  # caps, height, width, pixel format, linear size
+DDSD_MIPMAPCOUNT = 0x20000
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x8 | 0x400000  # complex, mipmap
+DDPF_FOURCC = 0x4
+
+# format -> (fourcc, dxgi format for the DX10 header, bytes per block)
+DDS_FORMATS = {
+    "bc1": (b"DXT1", None, 8),
+    "bc3": (b"DXT5", None, 16),
+    "bc7": (b"DX10", 98, 16),
+}
+# The names the old compression prompt took
+DDS_ALIASES = {"dxt1": "bc1", "dxt5": "bc3"}
+
+# Blocks encoded at once, keeps the memory use flat for big textures
+CHUNK_BLOCKS = 1 << 16
+
+BC1_BLOCK = np.dtype([("color0", "<u2"), ("color1", "<u2"), ("indices", "<u4")])
+
+# Position of each palette entry on the line between the endpoints and the index the format stores it as
+BC1_WEIGHTS = np.array([0, 1 / 3, 2 / 3, 1], dtype=np.float32)
+BC1_ORDER = np.array([0, 2, 3, 1], dtype=np.uint32)
+BC1_ALPHA_WEIGHTS = np.array([0, 1 / 2, 1], dtype=np.float32)
+BC1_ALPHA_ORDER = np.array([0, 2, 1], dtype=np.uint32)
+BC3_WEIGHTS = np.arange(8, dtype=np.float32) / 7
+BC3_ORDER = np.array([0, 2, 3, 4, 5, 6, 7, 1], dtype=np.uint64)
+BC7_WEIGHTS = np.array([0, 4, 9, 13, 17, 21, 26, 30, 34, 38, 43, 47, 51, 55, 60, 64], dtype=np.float32) / 64
+
+
+def get_format(compression):
+    compression = compression.lower()
+    compression = DDS_ALIASES.get(compression, compression)
+    if compression not in DDS_FORMATS:
+        raise ValueError(f"Unknown DDS compression {compression}, must be one of {', '.join(DDS_FORMATS)}")
+    return compression
+
+
+def get_blocks(image):
+    """Returns the 4x4 blocks of an image as a (blocks, 16, 4) RGBA array, edges are padded by repeating the last pixel."""
+    pixels = np.asarray(image.convert("RGBA"), dtype=np.float32)
+    height, width = pixels.shape[:2]
+    pixels = np.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode="edge")
+    rows, columns = pixels.shape[0] // 4, pixels.shape[1] // 4
+    return pixels.reshape(rows, 4, columns, 4, 4).swapaxes(1, 2).reshape(rows * columns, 16, 4)
+
+
+def fit_endpoints(pixels, weights):
+    """Returns the ends of the principal axis of every block, pixels with weight 0 are ignored."""
+    total = np.maximum(weights.sum(axis=1), 1e-6)[:, None]
+    mean = (pixels * weights[..., None]).sum(axis=1) / total
+    centered = (pixels - mean[:, None]) * weights[..., None]
+    covariance = np.einsum("nki,nkj->nij", centered, centered)
+
+    # Power iteration, starting from the channel with the most variance so the axis can't start orthogonal
+    channel = np.diagonal(covariance, axis1=1, axis2=2).argmax(axis=1)
+    axis = covariance[np.arange(len(pixels)), channel]
+    for _ in range(8):
+        axis = np.einsum("nij,nj->ni", covariance, axis)
+        axis /= np.maximum(np.linalg.norm(axis, axis=1), 1e-6)[:, None]
+
+    projection = np.einsum("nki,ni->nk", pixels - mean[:, None], axis)
+    low = np.where(weights > 0, projection, np.inf).min(axis=1)
+    high = np.where(weights > 0, projection, -np.inf).max(axis=1)
+    low = np.where(np.isfinite(low), low, 0)
+    high = np.where(np.isfinite(high), high, 0)
+    start = np.clip(mean + low[:, None] * axis, 0, 255)
+    end = np.clip(mean + high[:, None] * axis, 0, 255)
+    return start, end
+
+
+def get_positions(pixels, start, end, weights):
+    """Returns the index into weights of the palette entry closest to every pixel on the line from start to end."""
+    direction = end - start
+    length = np.maximum((direction * direction).sum(axis=-1), 1e-6)[:, None]
+    t = np.einsum("nki,ni->nk", pixels - start[:, None], direction) / length
+    return np.abs(t[..., None] - weights).argmin(axis=-1)
+
+
+def pack_565(color):
+    color = np.rint(color * np.array([31, 63, 31]) / 255).astype(np.uint32)
+    return (color[:, 0] << 11) | (color[:, 1] << 5) | color[:, 2]
+
+
+def unpack_565(value):
+    r, g, b = (value >> 11) & 31, (value >> 5) & 63, value & 31
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=1).astype(np.float32)
+
+
+def pack_indices(indices, bits):
+    return (indices.astype(np.uint64) << (np.arange(16, dtype=np.uint64) * np.uint64(bits))).sum(axis=1, dtype=np.uint64)
+
+
+def encode_bc1(blocks, alpha=True):
+    """Returns the BC1 blocks as a structured array, blocks with pixels under half alpha use the transparent 3 color mode."""
+    rgb = blocks[..., :3]
+    transparent = blocks[..., 3] < 128 if alpha else np.zeros(blocks.shape[:2], dtype=bool)
+    has_alpha = transparent.any(axis=1)
+    start, end = fit_endpoints(rgb, (~transparent).astype(np.float32))
+
+    # 4 color blocks are marked by color0 > color1, 3 color blocks by color0 <= color1
+    color0, color1 = pack_565(start), pack_565(end)
+    swap = np.where(has_alpha, color0 > color1, color0 < color1)
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+    start, end = unpack_565(color0), unpack_565(color1)
+
+    indices = np.where(
+        has_alpha[:, None],
+        np.where(transparent, 3, BC1_ALPHA_ORDER[get_positions(rgb, start, end, BC1_ALPHA_WEIGHTS)]),
+        BC1_ORDER[get_positions(rgb, start, end, BC1_WEIGHTS)],
+    )
+    # A single color block has color0 == color1 and can only use index 0
+    indices[(color0 == color1) & ~has_alpha] = 0
+
+    result = np.empty(len(blocks), dtype=BC1_BLOCK)
+    result["color0"] = color0
+    result["color1"] = color1
+    result["indices"] = pack_indices(indices, 2)
+    return result
+
+
+def encode_bc3(blocks):
+    alpha = blocks[..., 3]
+    alpha0 = alpha.max(axis=1)
+    alpha1 = alpha.min(axis=1)
+    t = (alpha0[:, None] - alpha) / np.maximum(alpha0 - alpha1, 1e-6)[:, None]
+    indices = BC3_ORDER[np.abs(t[..., None] - BC3_WEIGHTS).argmin(axis=-1)]
+    indices[alpha0 == alpha1] = 0
+
+    result = np.empty(len(blocks), dtype=[("alpha0", "u1"), ("alpha1", "u1"), ("indices", "u1", 6), ("color", BC1_BLOCK)])
+    result["alpha0"] = alpha0
+    result["alpha1"] = alpha1
+    result["indices"] = pack_indices(indices, 3).astype("<u8").view(np.uint8).reshape(-1, 8)[:, :6]
+    result["color"] = encode_bc1(blocks, alpha=False)
+    return result
+
+
+def quantize_bc7_endpoint(endpoint):
+    """
+    Returns the 7 bit endpoint and p bit that come closest to an 8 bit RGBA endpoint.
+    The p bit is shared by every channel, opaque endpoints always get p bit 1 since alpha 255 can't be stored without it.
+    """
+    best_color = best_bit = best_error = None
+    for bit in (0, 1):
+        color = np.clip(np.rint((endpoint - bit) / 2), 0, 127)
+        error = ((color * 2 + bit - endpoint) ** 2).sum(axis=1)
+        if best_error is None:
+            best_color, best_bit, best_error = color, np.zeros(len(endpoint)), error
+        else:
+            better = error < best_error
+            best_color = np.where(better[:, None], color, best_color)
+            best_bit = np.where(better, bit, best_bit)
+    opaque = endpoint[:, 3] >= 254.5
+    best_color = np.where(opaque[:, None], np.clip(np.rint((endpoint - 1) / 2), 0, 127), best_color)
+    best_bit = np.where(opaque, 1, best_bit)
+    return best_color.astype(np.uint64), best_bit.astype(np.uint64)
+
+
+def encode_bc7(blocks):
+    """
+    Returns the mode 6 BC7 blocks as a (blocks, 2) array of little endian 64 bit words.
+
+    >>> blocks = get_blocks(Image.new("RGBA", (8, 8), (200, 100, 50, 255)))
+    >>> int(decode_bc7(encode_bc7(blocks))[..., 3].min())
+    255
+    """
+    start, end = fit_endpoints(blocks, np.ones(blocks.shape[:2], dtype=np.float32))
+    color0, bit0 = quantize_bc7_endpoint(start)
+    color1, bit1 = quantize_bc7_endpoint(end)
+    indices = get_positions(blocks, (color0 * 2 + bit0[:, None]).astype(np.float32), (color1 * 2 + bit1[:, None]).astype(np.float32), BC7_WEIGHTS)
+
+    # The first index is stored with 3 bits, its top bit has to be 0 so swap the endpoints when it isn't
+    swap = indices[:, 0] >= 8
+    color0, color1 = np.where(swap[:, None], color1, color0), np.where(swap[:, None], color0, color1)
+    bit0, bit1 = np.where(swap, bit1, bit0), np.where(swap, bit0, bit1)
+    indices = np.where(swap[:, None], 15 - indices, indices).astype(np.uint64)
+
+    # Mode 6 layout: mode (7 bits), RGBA endpoint pairs (7 bits each), p bits, 3 bit anchor index and 15 4 bit indices
+    low = np.full(len(blocks), 1 << 6, dtype=np.uint64)
+    offset = 7
+    for channel in range(4):
+        low |= color0[:, channel] << np.uint64(offset)
+        low |= color1[:, channel] << np.uint64(offset + 7)
+        offset += 14
+    low |= bit0 << np.uint64(63)
+    high = bit1 | (indices[:, 0] << np.uint64(1))
+    high |= (indices[:, 1:] << (np.arange(15, dtype=np.uint64) * np.uint64(4) + np.uint64(4))).sum(axis=1, dtype=np.uint64)
+    return np.stack([low, high], axis=1).astype("<u8")
+
+
+def decode_bc7(encoded):
+    """Returns the (blocks, 16, 4) RGBA pixels of mode 6 BC7 blocks, used to check the encoder."""
+    low, high = encoded[:, 0].astype(np.uint64), encoded[:, 1].astype(np.uint64)
+    shifts = np.arange(4, dtype=np.uint64) * np.uint64(14) + np.uint64(7)
+    bit0 = (low >> np.uint64(63))[:, None]
+    bit1 = (high & np.uint64(1))[:, None]
+    endpoint0 = (((low[:, None] >> shifts) & np.uint64(127)) << np.uint64(1)) | bit0
+    endpoint1 = (((low[:, None] >> (shifts + np.uint64(7))) & np.uint64(127)) << np.uint64(1)) | bit1
+
+    indices = np.empty((len(encoded), 16), dtype=np.uint64)
+    indices[:, 0] = (high >> np.uint64(1)) & np.uint64(7)
+    indices[:, 1:] = (high[:, None] >> (np.arange(15, dtype=np.uint64) * np.uint64(4) + np.uint64(4))) & np.uint64(15)
+
+    weights = np.rint(BC7_WEIGHTS * 64).astype(np.int64)[indices.astype(np.intp)][..., None]
+    return ((64 - weights) * endpoint0[:, None].astype(np.int64) + weights * endpoint1[:, None].astype(np.int64) + 32) >> 6
+
+
+ENCODERS = {"bc1": encode_bc1, "bc3": encode_bc3, "bc7": encode_bc7}
+
+
+def encode_image(image, compression):
+    blocks = get_blocks(image)
+    encode = ENCODERS[compression]
+    return b"".join(encode(blocks[i : i + CHUNK_BLOCKS]).tobytes() for i in range(0, len(blocks), CHUNK_BLOCKS))
+
+
+def get_mipmaps(image):
+    """Returns the image and every mip level down to 1x1, each level is resized from the full image."""
+    levels = [image]
+    width, height = image.size
+    while width > 1 or height > 1:
+        width, height = max(width // 2, 1), max(height // 2, 1)
+        levels.append(image.resize((width, height), Image.LANCZOS))
+    return levels
+
+
+def get_header(width, height, mipmap_count, compression):
+    fourcc, dxgi_format, block_size = DDS_FORMATS[compression]
+    flags = DDSD_FLAGS | (DDSD_MIPMAPCOUNT if mipmap_count > 1 else 0)
+    caps = DDSCAPS_TEXTURE | (DDSCAPS_MIPMAP if mipmap_count > 1 else 0)
+    linear_size = max((width + 3) // 4, 1) * max((height + 3) // 4, 1) * block_size
+    header = (
+        DDS_MAGIC
+        + struct.pack("<7I", 124, flags, height, width, linear_size, 0, mipmap_count)
+        + struct.pack("<11I", *((0,) * 11))
+        + struct.pack("<2I4s5I", 32, DDPF_FOURCC, fourcc, 0, 0, 0, 0, 0)
+        + struct.pack("<5I", caps, 0, 0, 0, 0)
+    )
+    if dxgi_format:
+        # dxgi format, 2D texture, misc flags, array size, straight alpha
+        header += struct.pack("<5I", dxgi_format, 3, 0, 1, 1)
+    return header
+
+
+def save_dds(image, filename, compression="bc3", mipmaps=True):
+    compression = get_format(compression)
+    image = image.convert("RGBA")
+    levels = get_mipmaps(image) if mipmaps else [image]
+    with open(filename, "wb") as file:
+        file.write(get_header(image.width, image.height, len(levels), compression))
+        for level in levels:
+            file.write(encode_image(level, compression))
+
+
+if __name__ == "__main__":
+    import sys
+
+    save_dds(Image.open(sys.argv[1]), sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "bc3")
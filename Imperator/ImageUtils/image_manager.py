@@ -1,221 +1,426 @@
 import sys
 import os
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image, ImageOps
 from PIL.ImageColor import getcolor, getrgb
 from PIL.ImageOps import grayscale
 from tqdm import tqdm
 
+from dds_encoder import save_dds, get_format
+
+
+# round(x, -1) for every channel value, capped at 255
+ROUND_LUT = [min(round(x, -1), 255) for x in range(256)]
+
+# Decoded masks and frames kept in memory per process
+ASSET_CACHE_SIZE = 256 * 1024 * 1024
+
+
+class AssetCache:
+    """
+    Least recently used cache of masks and frames, keyed by (path, size, mode) and bounded by the bytes of pixel data.
+    The returned images are shared, callers must not modify them.
+    """
+
+    def __init__(self, max_bytes=ASSET_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.images = OrderedDict()
+
+    def get(self, path, size=None, mode=None):
+        key = (os.path.abspath(path), size, mode)
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+            return image
+
+        image = Image.open(path)
+        if mode:
+            image = image.convert(mode)
+        if size and image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        image.load()
+
+        self.images[key] = image
+        self.bytes += get_image_bytes(image)
+        # Always keep the newest image even if it's bigger than the whole cache
+        while self.bytes > self.max_bytes and len(self.images) > 1:
+            _, evicted = self.images.popitem(last=False)
+            self.bytes -= get_image_bytes(evicted)
+        return image
+
 
 class ImageManager:
-    def __init__(self, inputdir, outputdir):
+    def __init__(self, inputdir, outputdir, jobs=1):
         self.inputdir = inputdir
         self.outputdir = outputdir
+        self.jobs = jobs if jobs > 0 else os.cpu_count() or 1
 
-    def get_pbar(self, filter_func=lambda x: x):
-        pbar = []
+    def get_files(self, filter_func=lambda x: True):
+        files = []
         for file in os.scandir(path=self.inputdir):
-            pbar.append(file.path)
-        pbar = [x for x in pbar if filter_func]
-        progressbar = tqdm(pbar)
-        return progressbar
+            files.append(file.path)
+        return [x for x in files if filter_func(x)]
+
+    def run(self, func, *args, filter_func=lambda x: True):
+        """
+        Call func(filename, *args) for every file in the input directory, in a process pool when jobs is more than 1.
+        A file that fails doesn't stop the others, the errors are printed once every file is done.
+        """
+        files = self.get_files(filter_func)
+        results = []
+        if self.jobs > 1 and len(files) > 1:
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [executor.submit(process_file, func, x, args) for x in files]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    results.append(future.result())
+        else:
+            for filename in tqdm(files):
+                results.append(process_file(func, filename, args))
+
+        errors = [x for x in results if x is not None]
+        for filename, error in errors:
+            print(f"{terminal_red('Failed')} {filename}\n{error}")
+        if errors:
+            print(f"{len(errors)} of {len(files)} files failed")
+        return errors
 
     def get_file_name(self, filename):
         inputdir_rel = self.inputdir.rpartition("/")[2]
         return f"{self.outputdir}/{filename}".replace(inputdir_rel, "")
 
     def add_mask(self, mask_file):
-        for filename in self.get_pbar():
-            src = Image.open(filename)
-            mask = Image.open(mask_file)
-            mask = mask.convert("L")
+        return self.run(self.mask_image, mask_file)
 
-            mask = mask.resize(src.size, Image.BILINEAR)
-            out = ImageOps.fit(src, mask.size, centering=(0.5, 0.5))
+    def mask_image(self, filename, mask_file):
+        out = apply_mask(Image.open(filename), mask_file)
 
-            out.putalpha(mask)
-
-            if (
-                out.mode in ("RGBA")
-                and filename.endswith(".jpg")
-                or filename.endswith(".jpeg")
-            ):
-                # jpg has no alpha so just save as a png instead, could probably find a better way to add mask to jpg
-                filename = filename.replace(".jpg", ".png").replace(".jpeg", ".png")
-            out.save(self.get_file_name(filename))
+        if (
+            out.mode in ("RGBA")
+            and filename.endswith(".jpg")
+            or filename.endswith(".jpeg")
+        ):
+            # jpg has no alpha so just save as a png instead, could probably find a better way to add mask to jpg
+            filename = filename.replace(".jpg", ".png").replace(".jpeg", ".png")
+        out.save(self.get_file_name(filename))
 
     def add_frame_to_center(self, frame_file):
-        for filename in self.get_pbar():
-            input_image = Image.open(filename).convert("RGBA")
-            frame_image = Image.open(frame_file).convert("RGBA")
-
-            frame_size = frame_image.size
-            input_size = input_image.size
-            frame_pos = (
-                (input_size[0] - frame_size[0]) // 2,
-                (input_size[1] - frame_size[1]) // 2,
-            )
-
-            crop_box = (
-                frame_pos[0],
-                frame_pos[1],
-                frame_pos[0] + frame_size[0],
-                frame_pos[1] + frame_size[1],
-            )
-
-            input_image = input_image.crop(crop_box)
+        return self.run(self.frame_image, frame_file)
 
-            output_image = Image.new("RGBA", frame_size)
-            output_image.paste(input_image, (0, 0), input_image)
-            output_image.paste(frame_image, (0, 0), frame_image)
-
-            output_image.save(self.get_file_name(filename))
+    def frame_image(self, filename, frame_file):
+        output_image = apply_frame(Image.open(filename), frame_file)
+        output_image.save(self.get_file_name(filename))
 
     def split_grid(self, xPieces, yPieces):
-        xPieces = int(xPieces)
-        yPieces = int(yPieces)
-
-        for i, filename in enumerate(self.get_pbar()):
-            fname, file_extension = os.path.splitext(filename)
-            image = Image.open(filename)
-            imgwidth, imgheight = image.size
-            height = imgheight // yPieces
-            width = imgwidth // xPieces
-            for i in range(0, yPieces):
-                for j in range(0, xPieces):
-                    box = (j * width, i * height, (j + 1) * width, (i + 1) * height)
-                    a = image.crop(box)
-                    a.save(
-                        self.get_file_name(fname)
-                        + "-"
-                        + str(i)
-                        + "-"
-                        + str(j)
-                        + file_extension
-                    )
-
-    def compress_images_in_dir(self, filetype, dds_compression=""):
-        pbar = self.get_pbar(lambda f: True if f.endswith(filetype) else False)
-        for filename in pbar:
-            save_filename = self.get_file_name(filename)
-            if filetype == ".dds":
-                # DDS files get compressed differently
-                image = Image.open(filename)
-                image2 = image.convert(dds_compression.upper())
-                image2.save(save_filename)
-            elif filetype in (".jpg", ".jpeg", ".png"):
-                # Not entirely sure how this works but it's really good lossless png and jpg compression
-                abs_image_path = os.getcwd() + "/" + filename
-
-                image = Image.open(abs_image_path, "r")
-                pix_val = list(image.getdata())
-
-                templs = [round(x, -1) for sets in pix_val for x in sets]
-                if image.mode in ("RGBA", "p"):
-                    new_pix = list(
-                        tuple(templs[i : i + 4]) for i in range(0, len(templs), 4)
-                    )
-                elif image.mode in ("RGB"):
-                    new_pix = list(
-                        tuple(templs[i : i + 3]) for i in range(0, len(templs), 3)
-                    )
-
-                image2 = Image.new(image.mode, image.size)
-                image2.putdata(new_pix)
-
-                if image.mode in ("RGBA", "p"):
-                    image2.save(save_filename, "PNG")
-                elif image.mode in ("RGB"):
-                    image2.save(save_filename, "JPEG")
+        return self.run(self.split_image, int(xPieces), int(yPieces))
+
+    def split_image(self, filename, xPieces, yPieces):
+        fname, file_extension = os.path.splitext(filename)
+        image = Image.open(filename)
+        imgwidth, imgheight = image.size
+        height = imgheight // yPieces
+        width = imgwidth // xPieces
+        for i in range(0, yPieces):
+            for j in range(0, xPieces):
+                box = (j * width, i * height, (j + 1) * width, (i + 1) * height)
+                a = image.crop(box)
+                a.save(
+                    self.get_file_name(fname)
+                    + "-"
+                    + str(i)
+                    + "-"
+                    + str(j)
+                    + file_extension
+                )
+
+    def compress_images_in_dir(self, filetype, dds_compression="bc3", colors=0, compress_level=6, quality=None, mipmaps=True):
+        return self.run(
+            self.compress_image,
+            filetype,
+            dds_compression,
+            colors,
+            compress_level,
+            quality,
+            mipmaps,
+            filter_func=lambda f: f.endswith(filetype),
+        )
+
+    def compress_image(self, filename, filetype, dds_compression="bc3", colors=0, compress_level=6, quality=None, mipmaps=True):
+        save_filename = self.get_file_name(filename)
+        if filetype == ".dds":
+            # DDS files get block compressed with a mipmap chain
+            save_dds(Image.open(filename), save_filename, dds_compression, mipmaps)
+        elif filetype in (".jpg", ".jpeg", ".png"):
+            image = apply_rounding(Image.open(filename))
+
+            if filetype == ".png":
+                if colors:
+                    image = apply_quantize(image, colors)
+                # Level 9 is about 15 times slower than the default 6 for a few percent smaller files
+                image.save(save_filename, "PNG", compress_level=compress_level)
             else:
-                image = Image.open(filename, "r")
-                image.save(save_filename)
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                options = {"quality": quality} if quality else {}
+                image.save(save_filename, "JPEG", optimize=True, **options)
+        else:
+            image = Image.open(filename, "r")
+            image.save(save_filename)
 
     def resize_images_in_dir(self, resize_x, resize_y):
-        resize_x = int(resize_x)
-        resize_y = int(resize_y)
-        for filename in self.get_pbar():
-            image = Image.open(filename)
-            image = image.resize((resize_x, resize_y))
-            filename = filename.replace(self.inputdir, self.outputdir)
-            image.save(filename)
+        return self.run(self.resize_image, int(resize_x), int(resize_y))
+
+    def resize_image(self, filename, resize_x, resize_y):
+        image = apply_resize(Image.open(filename), resize_x, resize_y)
+        filename = filename.replace(self.inputdir, self.outputdir)
+        image.save(filename)
 
     def downscale_images_in_dir(self, downscale_factor):
-        for filename in self.get_pbar():
-            image = Image.open(filename)
-            downscaled_image = image.resize(
-                (image.size[0] // downscale_factor, image.size[1] // downscale_factor)
-            )
-            downscaled_image.save(self.get_file_name(filename))
-
-    def convert_images_in_dir(self, old, new):
-        for filename in self.get_pbar():
-            src = Image.open(filename)
-            filename = filename.replace(old, new).replace(self.inputdir, self.outputdir)
-            src.save(filename)
+        return self.run(self.downscale_image, downscale_factor)
+
+    def downscale_image(self, filename, downscale_factor):
+        downscaled_image = apply_downscale(Image.open(filename), downscale_factor)
+        downscaled_image.save(self.get_file_name(filename))
+
+    def convert_images_in_dir(self, old, new, dds_compression="bc3", mipmaps=True):
+        return self.run(self.convert_image, old, new, dds_compression, mipmaps)
+
+    def convert_image(self, filename, old, new, dds_compression="bc3", mipmaps=True):
+        src = Image.open(filename)
+        filename = filename.replace(old, new).replace(self.inputdir, self.outputdir)
+        save_image(src, filename, dds_compression, mipmaps)
 
     def make_all_multiple_of_four(self):
-        # For GPU texture compression to work texture resolution must be a multiple of 4
-        pbar = self.get_pbar(lambda f: True if f.endswith(old) else False)
-        for filename in pbar:
-            image = Image.open(filename)
-            imgwidth, imgheight = image.size
-            while imgwidth % 4 != 0:
-                imgwidth -= 1
-            while imgheight % 4 != 0:
-                imgheight -= 1
-            image = image.resize((imgwidth, imgheight))
-            image.save(self.get_file_name(filename))
+        return self.run(self.make_multiple_of_four)
+
+    def make_multiple_of_four(self, filename):
+        image = apply_multiple_of_four(Image.open(filename))
+        image.save(self.get_file_name(filename))
 
     def tint_images_in_dir(self, tint="#ffffff"):
-        for filename in self.get_pbar():
-            src = Image.open(filename)
-            if src.mode not in ["RGB", "RGBA"]:
-                raise TypeError("Unsupported source image mode: {}".format(src.mode))
-            src.load()
-
-            tr, tg, tb = getrgb(tint)
-            tl = getcolor(tint, "L")  # tint color's overall luminosity
-            if not tl:
-                tl = 1  # avoid division by zero
-            tl = float(tl)  # compute luminosity preserving tint factors
-            sr, sg, sb = map(
-                lambda tv: tv / tl, (tr, tg, tb)
-            )  # per component adjustments
-
-            # create look-up tables to map luminosity to adjusted tint
-            # (using floating-point math only to compute table)
-            luts = (
-                tuple(map(lambda lr: int(lr * sr + 0.5), range(256)))
-                + tuple(map(lambda lg: int(lg * sg + 0.5), range(256)))
-                + tuple(map(lambda lb: int(lb * sb + 0.5), range(256)))
-            )
-            lum = grayscale(src)  # 8-bit luminosity version of whole image
-            if Image.getmodebands(src.mode) < 4:
-                merge_args = (src.mode, (lum, lum, lum))  # for RGB verion of grayscale
-            else:  # include copy of src image's alpha layer
-                a = Image.new("L", src.size)
-                a.putdata(src.getdata(3))
-                merge_args = (
-                    src.mode,
-                    (lum, lum, lum, a),
-                )  # for RGBA verion of grayscale
-                luts += tuple(range(256))  # for 1:1 mapping of copied alpha values
-
-            result = Image.merge(*merge_args).point(luts)
-            filename = filename.replace(self.inputdir, self.outputdir)
-            result.save(filename)
-
-
-def terminal_green(string):
-    return "\033[92m{}\033[00m".format(string)
-
-
-def terminal_cyan(string):
-    return "\033[96m{}\033[00m".format(string)
+        return self.run(self.tint_image, tint)
+
+    def tint_image(self, filename, tint="#ffffff"):
+        result = apply_tint(Image.open(filename), tint)
+        filename = filename.replace(self.inputdir, self.outputdir)
+        result.save(filename)
+
+    def run_pipeline(self, steps, extension=None, dds_compression="bc3", mipmaps=True):
+        return self.run(self.pipeline_image, steps, extension, dds_compression, mipmaps)
+
+    def pipeline_image(self, filename, steps, extension=None, dds_compression="bc3", mipmaps=True):
+        # The image is decoded once, goes through every step in memory and is encoded once
+        image = Image.open(filename)
+        for name, args in steps:
+            image = PIPELINE_STEPS[name][0](image, *args)
+
+        save_filename = self.get_file_name(filename)
+        if extension:
+            save_filename = os.path.splitext(save_filename)[0] + extension
+        if "A" in image.getbands() and save_filename.endswith((".jpg", ".jpeg")):
+            # jpg has no alpha so just save as a png instead
+            save_filename = os.path.splitext(save_filename)[0] + ".png"
+        save_image(image, save_filename, dds_compression, mipmaps)
+
+
+def apply_mask(src, mask_file):
+    mask = ASSET_CACHE.get(mask_file, src.size, "L")
+    out = ImageOps.fit(src, mask.size, centering=(0.5, 0.5))
+
+    out.putalpha(mask)
+    return out
+
+
+def apply_frame(input_image, frame_file):
+    input_image = input_image.convert("RGBA")
+    frame_image = ASSET_CACHE.get(frame_file, mode="RGBA")
+
+    frame_size = frame_image.size
+    input_size = input_image.size
+    frame_pos = (
+        (input_size[0] - frame_size[0]) // 2,
+        (input_size[1] - frame_size[1]) // 2,
+    )
+
+    crop_box = (
+        frame_pos[0],
+        frame_pos[1],
+        frame_pos[0] + frame_size[0],
+        frame_pos[1] + frame_size[1],
+    )
+
+    input_image = input_image.crop(crop_box)
+
+    output_image = Image.new("RGBA", frame_size)
+    output_image.paste(input_image, (0, 0), input_image)
+    output_image.paste(frame_image, (0, 0), frame_image)
+    return output_image
+
+
+def apply_resize(image, resize_x, resize_y):
+    return image.resize((resize_x, resize_y))
+
+
+def apply_downscale(image, downscale_factor):
+    return image.resize(
+        (image.size[0] // downscale_factor, image.size[1] // downscale_factor)
+    )
+
+
+def apply_multiple_of_four(image):
+    # For GPU texture compression to work texture resolution must be a multiple of 4
+    imgwidth, imgheight = image.size
+    while imgwidth % 4 != 0:
+        imgwidth -= 1
+    while imgheight % 4 != 0:
+        imgheight -= 1
+    return image.resize((imgwidth, imgheight))
+
+
+def apply_tint(src, tint="#ffffff"):
+    if src.mode not in ["RGB", "RGBA"]:
+        raise TypeError("Unsupported source image mode: {}".format(src.mode))
+    src.load()
+
+    tr, tg, tb = getrgb(tint)
+    tl = getcolor(tint, "L")  # tint color's overall luminosity
+    if not tl:
+        tl = 1  # avoid division by zero
+    tl = float(tl)  # compute luminosity preserving tint factors
+    sr, sg, sb = map(
+        lambda tv: tv / tl, (tr, tg, tb)
+    )  # per component adjustments
+
+    # create look-up tables to map luminosity to adjusted tint
+    # (using floating-point math only to compute table)
+    luts = (
+        tuple(map(lambda lr: int(lr * sr + 0.5), range(256)))
+        + tuple(map(lambda lg: int(lg * sg + 0.5), range(256)))
+        + tuple(map(lambda lb: int(lb * sb + 0.5), range(256)))
+    )
+    lum = grayscale(src)  # 8-bit luminosity version of whole image
+    if Image.getmodebands(src.mode) < 4:
+        merge_args = (src.mode, (lum, lum, lum))  # for RGB verion of grayscale
+    else:  # include copy of src image's alpha layer
+        a = Image.new("L", src.size)
+        a.putdata(src.getdata(3))
+        merge_args = (
+            src.mode,
+            (lum, lum, lum, a),
+        )  # for RGBA verion of grayscale
+        luts += tuple(range(256))  # for 1:1 mapping of copied alpha values
+
+    return Image.merge(*merge_args).point(luts)
+
+
+def apply_rounding(image):
+    # Rounding every channel to a multiple of 10 leaves far fewer distinct colors, which compress a lot better
+    if image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert("RGBA")
+    return image.point(ROUND_LUT * len(image.getbands()))
+
+
+def apply_quantize(image, colors):
+    # Real palette quantization, the png stores one byte per pixel plus the palette
+    if image.mode == "LA":
+        # quantize only takes L, RGB and RGBA images
+        image = image.convert("RGBA")
+    method = Image.Quantize.FASTOCTREE if "A" in image.getbands() else Image.Quantize.MEDIANCUT
+    return image.quantize(colors=colors, method=method)
+
+
+def save_image(image, filename, dds_compression="bc3", mipmaps=True):
+    # Pillow can't write mipmaps or BC7, so DDS files go through our own encoder
+    if filename.lower().endswith(".dds"):
+        save_dds(image, filename, dds_compression, mipmaps)
+    else:
+        image.save(filename)
+
+
+def get_image_bytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+ASSET_CACHE = AssetCache()
+
+
+# Pipeline step name -> (function, argument types), convert is handled by the pipeline itself
+PIPELINE_STEPS = {
+    "mask": (apply_mask, (str,)),
+    "frame": (apply_frame, (str,)),
+    "tint": (apply_tint, (str,)),
+    "resize": (apply_resize, (int, int)),
+    "downscale": (apply_downscale, (int,)),
+    "multiple_of_four": (apply_multiple_of_four, ()),
+    "round": (apply_rounding, ()),
+    "quantize": (apply_quantize, (int,)),
+}
+
+
+def parse_pipeline(spec):
+    """
+    Parse a pipeline from a file with one step per line or a string of steps separated by ;
+    Returns the steps as (name, args) and the extension to save as, or None to keep the input extension.
+    """
+    if os.path.isfile(spec):
+        with open(spec, "r", encoding="utf-8") as file:
+            # Tint colors start with # so only whole lines can be comments
+            lines = [x for x in file.read().splitlines() if not x.strip().startswith("#")]
+    else:
+        lines = spec.split(";")
+
+    steps = []
+    extension = None
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        name, args = parts[0], parts[1:]
+        if name == "convert" and len(args) == 1:
+            extension = args[0] if args[0].startswith(".") else "." + args[0]
+            continue
+        if name not in PIPELINE_STEPS:
+            raise ValueError(f"Unknown pipeline step: {name}")
+        types = PIPELINE_STEPS[name][1]
+        if len(args) != len(types):
+            raise ValueError(f"{name} takes {len(types)} arguments but got {len(args)}")
+        steps.append((name, tuple(t(x) for t, x in zip(types, args))))
+    return steps, extension
+
+
+def process_file(func, filename, args):
+    # Runs in the worker processes, returns the error instead of raising so one bad file doesn't stop the batch
+    try:
+        func(filename, *args)
+    except Exception:
+        return filename, traceback.format_exc()
+    return None
+
+
+def terminal_red(string):
+    return "\033[91m{}\033[00m".format(string)
+
+
+def pop_option(name, default=None):
+    # Options can go anywhere after the positional arguments, they are removed from sys.argv so the positions stay the same
+    if name not in sys.argv:
+        return default
+    index = sys.argv.index(name)
+    value = sys.argv[index + 1]
+    del sys.argv[index : index + 2]
+    return value
 
 
 def main():
     try:
+        jobs = int(pop_option("-jobs", 1))
+        colors = int(pop_option("-colors", 0))
+        compress_level = int(pop_option("-level", 6))
+        quality = int(pop_option("-quality", 0)) or None
+        dds_compression = get_format(pop_option("-dds", "bc3"))
+        mipmaps = pop_option("-mipmaps", "1") != "0"
         input_dir = sys.argv[1]
         output_dir = sys.argv[2]
         mode = sys.argv[3]
@@ -228,6 +433,7 @@ def main():
             "-tint",
             "-frame",
             "-downscale",
+            "-pipeline",
         ):
             raise (RuntimeError)
 
@@ -246,13 +452,8 @@ def main():
                     output_format = "." + output_format
             case "-compress":
                 compress_format = sys.argv[4]
-                dds_compression = "dxt5"
                 if not compress_format.startswith("."):
                     compress_format = "." + compress_format
-                if compress_format == ".dds":
-                    enter_dds = terminal_green("Enter DDS Compression format ")
-                    dds_formats = terminal_cyan("dxt1/dxt3/dxt5")
-                    dds_compression = input(f"\n{enter_dds}({dds_formats}): ")
             case "-resize":
                 resize_x = sys.argv[4]
                 resize_y = sys.argv[5]
@@ -262,31 +463,42 @@ def main():
                 frame_file = sys.argv[4]
             case "-downscale":
                 downscale_factor = int(sys.argv[4])
+            case "-pipeline":
+                steps, extension = parse_pipeline(sys.argv[4])
 
-    except (IndexError, RuntimeError):
+    except (IndexError, ValueError, RuntimeError):
         print(
-            "Incorrect arguments. Valid arguments are: -convert, -grid, -mask, -compress, -tint, -frame, -downscale, or -resize"
+            "Incorrect arguments. Valid arguments are: -convert, -grid, -mask, -compress, -tint, -frame, -downscale, -pipeline or -resize"
         )
+        print("Add -jobs N to process N files at the same time, -jobs 0 uses every core")
+        print("-compress png also takes -colors N to quantize to a palette of N colors and -level 0-9 for the zlib level (default 6), -compress jpg takes -quality 1-95")
+        print('-pipeline takes a file with one step per line or steps separated by ;, e.g. "mask masks/event_picture_alpha_big.png; tint #ff0084; resize 54 54; convert png"')
+        print("Writing dds takes -dds bc1/bc3/bc7 for the block compression (default bc3) and -mipmaps 0 to leave out the mipmaps")
         return
 
-    image = ImageManager(input_dir, output_dir)
+    image = ImageManager(input_dir, output_dir, jobs)
     match mode:
         case "-mask":
-            image.add_mask(mask_file)
+            errors = image.add_mask(mask_file)
         case "-grid":
-            image.split_grid(grid_x, grid_y)
+            errors = image.split_grid(grid_x, grid_y)
         case "-convert":
-            image.convert_images_in_dir(input_format, output_format)
+            errors = image.convert_images_in_dir(input_format, output_format, dds_compression, mipmaps)
         case "-compress":
-            image.compress_images_in_dir(compress_format, dds_compression)
+            errors = image.compress_images_in_dir(compress_format, dds_compression, colors, compress_level, quality, mipmaps)
         case "-resize":
-            image.resize_images_in_dir(resize_x, resize_y)
+            errors = image.resize_images_in_dir(resize_x, resize_y)
         case "-tint":
-            image.tint_images_in_dir(tint_color)
+            errors = image.tint_images_in_dir(tint_color)
         case "-frame":
-            image.add_frame_to_center(frame_file)
+            errors = image.add_frame_to_center(frame_file)
         case "-downscale":
-            image.downscale_images_in_dir(downscale_factor)
+            errors = image.downscale_images_in_dir(downscale_factor)
+        case "-pipeline":
+            errors = image.run_pipeline(steps, extension, dds_compression, mipmaps)
+
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,2 @@
+@echo off
+python image_manager.py input output -pipeline "mask masks/event_picture_alpha_big.png; tint #ff0084; resize 54 54; convert png"
\ No newline at end of file
@@ -1,181 +1,335 @@
-import re
-from pathlib import Path
+import io
+import os
+import codecs
+import difflib
+import tempfile
+import json
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from province_index import ProvinceIndex, DEFAULT_INDEX_FILE, PROVINCE_RE, FIELD_RE, FIELDS, parse_fields, split_comment
+
+"""
+    Check the province setup files for missing fields and values that aren't allowed.
+    The rules are read from a json schema, see province_schema.json for the default:
+        required: fields every province has to have
+        allowed: the values a field is allowed to have in every province
+        terrain_rules: the values fields are allowed to have in provinces with a specific terrain
+
+        defaults: values given to fields that are missing when fixing
+        fixes: the values fields are set to when fixing provinces with a specific terrain
+
+    Usage: python check_province_setup.py -path "path/to/your/mod/setup/provinces"
+    Fix the files in place: python check_province_setup.py -path "path/to/your/mod/setup/provinces" -fix
+    Preview the fixes: python check_province_setup.py -path "path/to/your/mod/setup/provinces" -fix -dryrun
+"""
+
+# Missing fields are added in the order of FIELDS when a province is rebuilt, other fields are added after these
+CLEARED_PROVINCE = {
+    "terrain": "impassable_terrain",
+    "culture": "placeholder",
+    "religion": "the_first_emperor",
+    "trade_goods": "",
+    "civilization_value": 0,
+    "barbarian_power": 0,
+    "province_rank": "",
+}
+
+DEFAULT_SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "province_schema.json")
+
+
+class ProvinceError(NamedTuple):
+    file: str
+    line: int
+    province: str
+    field: str
+    message: str
+
+    def __str__(self):
+        return f"{self.file}:{self.line}: province {self.province} {self.field}: {self.message}"
 
-# Check for missing fields in province setup
 
 class ProvinceChecker:
-    def __init__(self, text):
+    def __init__(self, text, key, line=1):
         self.data = {}
-        self.key = ""
-        for i, line in enumerate(text.split("\n")):
-            match = re.match(r"(.+?)\s?=\s?(.+)", line)
-            if match:
-                key = match.group(1).strip()
-                if i == 0:
-                    self.key = key
-                value = match.group(2).strip()
-                self.data[key] = value
+        self.lines = {}
+        self.key = key
+        self.line = line
+        # The province body as it is in the file, rebuilding only edits the lines of changed fields
+        self.body = text.split("\n") if text else []
+        fields, _ = parse_fields(text, self.line)
+        for key, (value, line, _) in fields.items():
+            self.data[key] = value
+            self.lines[key] = line
+        self.original = dict(self.data)
         setattr(self, "data", self.data)
 
+    @classmethod
+    def from_province(cls, province):
+        """Create a checker from a province in the ProvinceIndex."""
+        checker = cls("", str(province.id), province.line)
+        for field, (value, line) in province.data.items():
+            checker.data[field] = value
+            checker.lines[field] = line
+        return checker
+
     def rebuild_province(self):
-        text = f"{self.key}={{\n"
-
-        terrain = self.data["terrain"]
-        text += f"\tterrain={terrain}\n"
-        culture = self.data["culture"]
-        text += f"\tculture={culture}\n"
-        religion = self.data["religion"]
-        text += f"\treligion={religion}\n"
-        trade_goods = self.data["trade_goods"]
-        text += f"\ttrade_goods={trade_goods}\n"
-        civilization_value = self.data["civilization_value"]
-        text += f"\tcivilization_value={civilization_value}\n"
-        barbarian_power = self.data["barbarian_power"]
-        text += f"\tbarbarian_power={barbarian_power}\n"
-        province_rank = self.data["province_rank"]
-        text += f"\tprovince_rank={province_rank}\n"
-        text += "}"
-
-        return text
+        """
+        Returns the province with changed values replaced on their own line and missing fields added before the closing brace,
+        every other line including comments, blank lines and nested blocks is kept as it is.
+
+        >>> province = ProvinceChecker('\\n\\tname="A #1 place"\\n\\n\\t# note\\n\\tterrain="ocean" # keep as ocean', "1")
+        >>> province.data["terrain"] = '"plains"'
+        >>> province.data["culture"] = '"roman"'
+        >>> province.rebuild_province().split("\\n")
+        ['1={', '\\tname="A #1 place"', '', '\\t# note', '\\tterrain="plains" # keep as ocean', '\\tculture="roman"', '}']
+        """
+        body = list(self.body)
+        missing = list()
+        for key in sorted(self.data, key=get_field_order):
+            value = self.data[key]
+            if key not in self.original or key not in self.lines:
+                missing.append(f"\t{key}={value}")
+            elif value != self.original[key]:
+                i = self.lines[key] - self.line
+                body[i] = replace_value(body[i], value)
+
+        buffer = io.StringIO()
+        buffer.write(f"{self.key}={{")
+        buffer.write("\n".join(body))
+        buffer.write("\n")
+        for line in missing:
+            buffer.write(f"{line}\n")
+        buffer.write("}")
+        return buffer.getvalue()
 
     def rebuild_and_clear_province(self):
-        text = f"{self.key}={{\n"
-
-        terrain = self.data["terrain"].replace("\"", "")
-        if terrain == "impassable_terrain":
-            text += f"\tterrain={terrain}\n"
-            culture = self.data["culture"]
-            text += f"\tculture=\"placeholder\"\n"
-            religion = self.data["religion"]
-            text += f"\treligion=\"the_first_emperor\"\n"
-            trade_goods = self.data["trade_goods"]
-            text += f"\ttrade_goods={trade_goods}\n"
-            civilization_value = self.data["civilization_value"]
-            text += f"\tcivilization_value={civilization_value}\n"
-            barbarian_power = self.data["barbarian_power"]
-            text += f"\tbarbarian_power={barbarian_power}\n"
-            province_rank = self.data["province_rank"]
-            text += f"\tprovince_rank={province_rank}\n"
-        else:
-            text += f"\tterrain=\"impassable_terrain\"\n"
-            culture = self.data["culture"]
-            text += f"\tculture=\"placeholder\"\n"
-            religion = self.data["religion"]
-            text += f"\treligion=\"the_first_emperor\"\n"
-            trade_goods = self.data["trade_goods"]
-            text += f"\ttrade_goods=\"\"\n"
-            civilization_value = self.data["civilization_value"]
-            text += f"\tcivilization_value=0\n"
-            barbarian_power = self.data["barbarian_power"]
-            text += f"\tbarbarian_power=0\n"
-            province_rank = self.data["province_rank"]
-            text += f"\tprovince_rank=\"\"\n"
-
-        text += "}"
-        return text
-
-    def check_province(self):
-        terrain = True
-        culture = True
-        religion = True
-        trade_goods = True
-        civilization_value = True
-        barbarian_power = True
-        province_rank = True
-
-        try:
-            self.data["terrain"]
-        except KeyError:
-            terrain = False
-        try:
-            self.data["culture"]
-        except KeyError:
-            culture = False
-        try:
-            self.data["religion"]
-        except KeyError:
-            religion = False
-        try:
-            self.data["trade_goods"]
-        except KeyError:
-            trade_goods = False
-        try:
-            self.data["civilization_value"]
-        except KeyError:
-            civilization_value = False
-        try:
-            self.data["barbarian_power"]
-        except KeyError:
-            barbarian_power = False
-        try:
-            self.data["province_rank"]
-        except KeyError:
-            province_rank = False
-
-        return (terrain, culture, religion, trade_goods, civilization_value, barbarian_power, province_rank)
-
-def get_provinces_in_file(filename):
-    with open(filename, 'r', encoding="utf-8-sig") as file:
-        text = file.read()
-
-    provinces = re.findall(r'(\d+)=\{(.+?)\n\}', text, re.DOTALL)
-    return provinces
+        self.clear()
+        return self.rebuild_province()
+
+    def clear(self):
+        """Turn the province into impassable terrain with every value cleared."""
+        for field, value in CLEARED_PROVINCE.items():
+            self.data[field] = format_value(value)
+
+    def fix(self, schema):
+        """Fill in missing fields and apply the terrain fixes from the schema, returns True if anything changed."""
+        old = dict(self.data)
+        for field, value in schema.get("defaults", {}).items():
+            self.data.setdefault(field, format_value(value))
+
+        terrain = self.get_value("terrain") if "terrain" in self.data else ""
+        for field, value in schema.get("fixes", {}).get(terrain, {}).items():
+            self.data[field] = format_value(value)
+        return self.data != old
+
+    def get_value(self, field):
+        # Values are compared without their quotes
+        return self.data[field].strip('"')
+
+    def check_province(self, schema):
+        """Check the province against the schema, returns a list of (line, field, message) tuples."""
+        errors = list()
+        for field in schema.get("required", []):
+            if field not in self.data:
+                errors.append((self.line, field, "missing"))
+
+        for field, allowed in schema.get("allowed", {}).items():
+            if field in self.data and self.get_value(field) not in allowed:
+                errors.append((self.lines[field], field, f'"{self.get_value(field)}" is not allowed, must be {format_allowed(allowed)}'))
+
+        terrain = self.get_value("terrain") if "terrain" in self.data else ""
+        for field, allowed in schema.get("terrain_rules", {}).get(terrain, {}).items():
+            if field in self.data and self.get_value(field) not in allowed:
+                errors.append((self.lines[field], field, f'"{self.get_value(field)}" is not allowed for {terrain}, must be {format_allowed(allowed)}'))
+
+        return errors
+
+
+def replace_value(line, value):
+    """Replace the value of the key=value field on a line, the whitespace and comment around it are kept."""
+    code, comment = split_comment(line)
+    field = FIELD_RE.match(code)
+    start = field.start(2) + len(field.group(2)) - len(field.group(2).lstrip())
+    end = field.start(2) + len(field.group(2).rstrip())
+    return code[:start] + value + code[end:] + comment
+
+
+def get_field_order(field):
+    return FIELDS.index(field) if field in FIELDS else len(FIELDS)
+
+
+def format_value(value):
+    # Strings in the schema are written quoted, numbers as they are
+    return f'"{value}"' if isinstance(value, str) else str(value)
+
+
+def format_allowed(allowed):
+    return " or ".join(f'"{x}"' for x in allowed)
+
+
+def check_index(index, schema):
+    """Check every province in the index, returns a list of ProvinceErrors."""
+    errors = list()
+    for province in index.get_provinces():
+        checker = ProvinceChecker.from_province(province)
+        name = os.path.basename(province.file)
+        for error_line, field, message in checker.check_province(schema):
+            errors.append(ProvinceError(name, error_line, checker.key, field, message))
+    return errors
+
+
+def read_file(filename):
+    """Returns the text of a file with \\n newlines, the encoding and the newline the file used."""
+    with open(filename, 'rb') as file:
+        raw = file.read()
+
+    encoding = "utf-8-sig" if raw.startswith(codecs.BOM_UTF8) else "utf-8"
+    newline = "\r\n" if b"\r\n" in raw else "\n"
+    return raw.decode(encoding).replace("\r\n", "\n"), encoding, newline
+
+
+def write_file(filename, text, encoding, newline):
+    # Write to a temporary file next to the original and swap it in so a failed write never leaves a half written file
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding, newline=newline) as file:
+            file.write(text)
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def fix_file(filename, schema, clear_ids=frozenset(), dry_run=False):
+    """Rewrite every province in a setup file that needs fixing, returns the number of fixed provinces and the diff."""
+    text, encoding, newline = read_file(filename)
+
+    buffer = io.StringIO()
+    pos = 0
+    fixed = 0
+    for match in PROVINCE_RE.finditer(text):
+        province = ProvinceChecker(match.group(2), match.group(1))
+        if province.key in clear_ids:
+            province.clear()
+        elif not province.fix(schema):
+            continue
+
+        # Everything outside of changed provinces is copied as it is
+        buffer.write(text[pos:match.start()])
+        buffer.write(province.rebuild_province())
+        pos = match.end()
+        fixed += 1
+
+    if not fixed:
+        return fixed, ""
+
+    buffer.write(text[pos:])
+    new_text = buffer.getvalue()
+    if dry_run:
+        name = os.path.basename(filename)
+        return fixed, "".join(difflib.unified_diff(text.splitlines(True), new_text.splitlines(True), name, name))
+
+    write_file(filename, new_text, encoding, newline)
+    return fixed, ""
+
+
+def fix_files(files, schema, clear_ids=frozenset(), dry_run=False, jobs=1):
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    fix = partial(fix_file, schema=schema, clear_ids=clear_ids, dry_run=dry_run)
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(fix, files))
+    return [fix(x) for x in files]
+
+
+def is_valid_directory(parser, arg):
+    if not os.path.isdir(arg):
+        parser.error(f"The directory {arg} does not exist!")
+    return arg
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check Imperator Rome province setup files for missing and invalid fields.")
+    parser.add_argument(
+        "-path",
+        help="The path to the setup/provinces folder.",
+        type=lambda x: is_valid_directory(parser, x),
+        required=True,
+    )
+    parser.add_argument(
+        "-schema",
+        help="The json file with the rules provinces are checked against.",
+        default=DEFAULT_SCHEMA_FILE,
+    )
+    parser.add_argument(
+        "-jobs",
+        help="The number of processes used to parse and fix files. 0 uses every core.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-index",
+        help="The sqlite file the province index is stored in, only changed files are parsed again.",
+        default=DEFAULT_INDEX_FILE,
+    )
+    parser.add_argument(
+        "-noindex",
+        help="Keep the province index in memory instead of writing it to disk.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-fix",
+        help="Rewrite provinces that break the schema using its defaults and fixes before checking.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-clear",
+        help="Province ids to turn into impassable terrain with every value cleared, implies -fix.",
+        nargs="+",
+        default=[],
+    )
+    parser.add_argument(
+        "-dryrun",
+        help="Print a diff of what -fix would change without writing anything.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-json",
+        help="Print the errors as json instead of one error per line.",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    with open(args.schema, 'r', encoding="utf-8") as file:
+        schema = json.load(file)
+
+    files = [os.path.join(args.path, x) for x in sorted(os.listdir(args.path)) if x.endswith(".txt")]
+
+    if args.fix or args.clear:
+        results = fix_files(files, schema, frozenset(args.clear), args.dryrun, args.jobs)
+        for fixed, diff in results:
+            if diff:
+                print(diff, end="")
+        action = "Would fix" if args.dryrun else "Fixed"
+        print(f"{action} {sum(x[0] for x in results)} provinces in {sum(1 for x in results if x[0])} files")
+        if args.dryrun:
+            raise SystemExit(0)
+
+    index = ProvinceIndex(":memory:" if args.noindex else args.index)
+    index.update(files, args.jobs)
+    errors = check_index(index, schema)
+    index.close()
+
+    if args.json:
+        print(json.dumps([x._asdict() for x in errors], indent=1))
+    else:
+        for error in errors:
+            print(error)
 
-    directory = "C:\\Users\\demen\\Documents\\Paradox Interactive\\Imperator\\mod\\Chronicles-of-Omniluxia\\setup\\provinces"
-    province_list = list()
-    key_list = list()
-
-    for filename in Path(directory).iterdir():
-        with open(filename, 'r', encoding="utf-8-sig") as file:
-            text = file.read()
-
-        provinces = re.findall(r'(\d+)=\{(.+?)\n\}', text, re.DOTALL)
-        error_list = list()
-
-        for i in provinces:
-            broken = False
-            province = ProvinceChecker(i[1])
-            province_list.append(province)
-            key_list.append(i[0])
-            checked = province.check_province()
-
-            if not checked[0]:
-                broken = True
-            if not checked[1]:
-                broken = True
-            if not checked[2]:
-                broken = True
-            if not checked[3]:
-                broken = True
-            if not checked[4]:
-                broken = True
-            if not checked[5]:
-                broken = True
-            if not checked[6]:
-                broken = True
-
-            # Check impassable_terrain entries
-            try:
-                if province.data["terrain"] == '"impassable_terrain"':
-                    if not province.data["trade_goods"] == '""' or not province.data["province_rank"] == '""':
-                        broken = True
-            except KeyError:
-                province_rank = False
-
-            # Check ocean entires
-            try:
-                if province.data["terrain"] == '"ocean"' or province.data["terrain"] == '"coastal_terrain"' or province.data["terrain"] == '"riverine_terrain"':
-                    if not province.data["trade_goods"] == '""' or not province.data["province_rank"] == '""':
-                        broken = True
-                    if not province.data["culture"] == '""' or not province.data["religion"] == '""':
-                        broken = True
-            except KeyError:
-                province_rank = False
-
-            if broken:
-                error_list.append(i[0])
-
-        if error_list:
-            print(f"{filename.name} - {error_list}")
+    if errors:
+        raise SystemExit(1)
@@ -1,44 +1,124 @@
+import os
 import re
-from pathlib import Path
+import argparse
+
+from province_index import ProvinceIndex, DEFAULT_INDEX_FILE, SEA_TERRAINS
+from check_province_setup import read_file, write_file, is_valid_directory
 
 """
-    Autogenerate impassable and sea lists for default.map with the province setup folder as input
+    Autogenerate the impassable, sea and lake lists for default.map with the province setup folder as input.
+    Existing LIST and RANGE entries for these lists are replaced by a single sorted LIST each, everything else in the file is kept.
+    A list that no province has the terrain for is left as it is in the file, unless -dropempty is given.
+    Lakes are only found if the mod gives its lake provinces terrain="lake".
+    The file is only written when the lists changed, so running this again does nothing.
+
+    Usage: python default_map_manager.py -path "path/to/your/mod/setup/provinces" -map "path/to/your/mod/map_data/default.map"
 """
 
-def get_provinces_in_file(filename):
-    with open(filename, 'r', encoding="utf-8-sig") as file:
-        text = file.read()
-
-    provinces = re.findall(r'(\d+)=\{(.+?)\n\}', text, re.DOTALL)
-    provs = list()
-    sea_provs = list()
-
-    for i in provinces:
-        pid = i[0]
-        p_data = i[1]
-        if '"impassable_terrain"' in p_data:
-            provs.append(pid)
-        if '"riverine_terrain"' in p_data or '"coastal_terrain"' in p_data or '"ocean"' in p_data:
-            sea_provs.append(pid)
-    return (provs, sea_provs)
-
-def write_list(li, name, comment):
-    if len(li) < 1:
-        return
-    with open(f"{name}.txt", 'a', encoding="utf-8-sig") as file:
-        file.write(f"# {comment}\n")
-        file.write(f"{name} = LIST {{ ")
-        for i in li:
-            file.write(f"{i} ")
-        file.write("}\n")
-
-def add_new_region_file(file):
-    impassable_ids, sea_ids = get_provinces_in_file(file)
-    comment = file.name
-    write_list(impassable_ids, "impassable_terrain", comment)
-    write_list(sea_ids, "sea_zones", comment)
+# Not a vanilla terrain, mods that want their lakes list generated have to use it in the setup files
+LAKE_TERRAINS = ("lake",)
+
+# default.map list name -> the terrains of the provinces in the list
+MAP_LISTS = {
+    "impassable_terrain": ("impassable_terrain",),
+    "sea_zones": SEA_TERRAINS,
+    "lakes": LAKE_TERRAINS,
+}
+
+
+def get_list_re(names):
+    # A trailing comment belongs to the list on its line and is matched with it
+    return re.compile(rf"^[ \t]*({'|'.join(names)})\s*=\s*(?:LIST|RANGE)\s*\{{[^}}]*\}}[ \t]*(#[^\n]*)?\n?", re.MULTILINE)
+
+
+def get_lists(index):
+    return {name: index.get_sorted_ids(terrains) for name, terrains in MAP_LISTS.items()}
+
+
+def render_lists(lists, comments=None):
+    """Returns the default.map lines of the lists, comments is a dict of list name -> the comment written after it."""
+    comments = comments or dict()
+    return "".join(
+        f"{name} = LIST {{ {' '.join(map(str, ids))} }}{' ' + comments[name] if name in comments else ''}\n"
+        for name, ids in lists.items() if ids
+    )
+
+
+def update_default_map(filename, lists, drop_empty=False):
+    """
+    Replace the lists in a default.map file, returns True if the file was written.
+    Empty lists keep their entries in the file unless drop_empty is set.
+    The trailing comment of the first entry of each list is kept on the new list, the comments of the other entries are removed with them.
+    """
+    names = [name for name, ids in lists.items() if ids or drop_empty]
+    if not names:
+        return False
+    list_re = get_list_re(names)
+
+    if os.path.exists(filename):
+        text, encoding, newline = read_file(filename)
+    else:
+        text, encoding, newline = "", "utf-8-sig", "\n"
+
+    # The new lists go where the first old one was, or at the end of the file
+    match = list_re.search(text)
+    pos = match.start() if match else len(text)
+    if not match and text and not text.endswith("\n"):
+        text += "\n"
+        pos += 1
+
+    comments = dict()
+    for old in list_re.finditer(text):
+        if old.group(2):
+            comments.setdefault(old.group(1), old.group(2).rstrip())
+
+    rest = list_re.sub("", text[pos:])
+    new_text = text[:pos] + render_lists({name: lists[name] for name in names}, comments) + rest
+    if new_text == text:
+        return False
+
+    write_file(filename, new_text, encoding, newline)
+    return True
+
 
 if __name__ == '__main__':
-    path_to_province_setup = "C:\\Users\\demen\\Documents\\Paradox Interactive\\Imperator\\mod\\Chronicles-of-Omniluxia\\setup\\provinces"
-    for file in Path(path_to_province_setup).iterdir():
-        add_new_region_file(file)
+    parser = argparse.ArgumentParser(description="Generate the impassable, sea and lake lists in default.map from the province setup files.")
+    parser.add_argument(
+        "-path",
+        help="The path to the setup/provinces folder.",
+        type=lambda x: is_valid_directory(parser, x),
+        required=True,
+    )
+    parser.add_argument(
+        "-map",
+        help="The default.map file to update, it is created if it doesn't exist.",
+        default="default.map",
+    )
+    parser.add_argument(
+        "-index",
+        help="The sqlite file the province index is stored in, only changed files are parsed again.",
+        default=DEFAULT_INDEX_FILE,
+    )
+    parser.add_argument(
+        "-jobs",
+        help="The number of processes used to parse files. 0 uses every core.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-dropempty",
+        help="Remove the entries of lists that no province has the terrain for instead of keeping them.",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    files = [os.path.join(args.path, x) for x in sorted(os.listdir(args.path)) if x.endswith(".txt")]
+    index = ProvinceIndex(args.index)
+    index.update(files, args.jobs)
+    lists = get_lists(index)
+    index.close()
+
+    if update_default_map(args.map, lists, args.dropempty):
+        print(f"Updated {args.map}: " + ", ".join(f"{len(ids)} {name}" for name, ids in lists.items()))
+    else:
+        print(f"{args.map} is already up to date")
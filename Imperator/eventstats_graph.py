@@ -1,24 +1,111 @@
-import matplotlib.pyplot as plt
+import os
+import hashlib
+import argparse
+import numpy as np
 import pandas as pd
+import plotly.graph_objects as go
 
-def show_plot(column="Sum", items=999, csvfile="onactionstats.csv", minimum_value=0.2):
-	data = pd.read_csv(csvfile, sep=";")
-	df = pd.DataFrame(data)
-	df = df.iloc[:items]
+"""
+	Plot the events in an eventstats.csv or onactionstats.csv file, or compare the stats of many runs.
 
-	indexes_to_drop = []
-	for i in df.index:
-		if df[column][i] < minimum_value:
-			indexes_to_drop.append(i)
-	df.drop(df.index[indexes_to_drop], inplace=True)
+	Plot a single file: python eventstats_graph.py -csv eventstats.csv
+	Plot every event to an html file: python eventstats_graph.py -csv eventstats.csv -items 0 -html eventstats.html
+	Compare runs: python eventstats_graph.py -runs run1/eventstats.csv run2/eventstats.csv -baseline base/eventstats.csv
+	With -store the runs are added to a .npz file so later runs only have to load their own csv.
+	Runs are told apart by the content of their csv, so the eventstats.csv the game rewrites after every run can be passed each time.
+"""
 
-	df = df.sort_values(column, ascending=False)
-	X = df["#ID"]
-	Y = df[column]
-	max_y = Y[0]
+CHUNK_SIZE = 500000
+RED_THRESHOLD = 2.5
+YELLOW_THRESHOLD = 1.0
+# Stores made before runs were keyed by their content can't be extended
+STORE_VERSION = 2
+
+
+def load_stats(csvfile, column="Sum", items=999, minimum_value=0.2, chunksize=CHUNK_SIZE):
+	"""
+	Returns the items rows with the highest value in column that are at least minimum_value, sorted from high to low.
+	The csv is read in chunks and only the top rows of each chunk are kept, so memory use doesn't grow with the file.
+	When items is 0 every row above the minimum is kept.
+	"""
+	top = None
+	reader = pd.read_csv(csvfile, sep=";", usecols=["#ID", column], dtype={"#ID": str, column: "float32"}, chunksize=chunksize)
+	for chunk in reader:
+		chunk = chunk[chunk[column] >= minimum_value]
+		if top is not None:
+			chunk = pd.concat([top, chunk])
+		top = chunk.nlargest(items, column) if items > 0 else chunk
+
+	if top is None:
+		return pd.DataFrame({"#ID": pd.Series(dtype=str), column: pd.Series(dtype="float32")})
+	return top.sort_values(column, ascending=False).reset_index(drop=True)
+
+
+def show_plot(column="Sum", items=999, csvfile="onactionstats.csv", minimum_value=0.2, backend="plotly", html=None):
+	df = load_stats(csvfile, column, items, minimum_value)
+	if df.empty:
+		print(f"No events in {csvfile} have a {column} of at least {minimum_value}")
+		return
+
+	max_y = df[column][0]
 	cap = 0.1 if max_y < 5 else 0.5
 	max_y += cap
 
+	if backend == "matplotlib":
+		show_matplotlib(df, column, max_y)
+		return
+
+	fig = get_figure(df, column, max_y, os.path.basename(csvfile))
+	if html:
+		fig.write_html(html, include_plotlyjs=True)
+	else:
+		fig.show()
+
+
+def get_figure(df, column, max_y, title=""):
+	"""
+	Plot the events as WebGL scatter traces, one for each threshold color.
+	Hovering is handled by plotly in the browser so it stays fast with hundreds of thousands of events.
+	"""
+	X = np.arange(len(df))
+	Y = df[column].to_numpy()
+	ids = df["#ID"].to_numpy()
+	bands = [
+		("green", Y < YELLOW_THRESHOLD),
+		("yellow", (Y >= YELLOW_THRESHOLD) & (Y < RED_THRESHOLD)),
+		("red", Y >= RED_THRESHOLD),
+	]
+
+	fig = go.Figure()
+	for color, mask in bands:
+		# One color per trace, a list of colors per point is very slow to validate
+		fig.add_trace(
+			go.Scattergl(
+				x=X[mask],
+				y=Y[mask],
+				mode="markers",
+				marker={"color": color},
+				name=color,
+				customdata=ids[mask],
+				hovertemplate=f"Event ID: %{{customdata}}<br>{column}: %{{y}}<extra></extra>",
+			)
+		)
+	fig.update_layout(
+		title=title,
+		xaxis={"title": "Events", "showticklabels": False},
+		showlegend=False,
+		yaxis={"title": column, "range": [0, max_y]},
+	)
+	return fig
+
+
+def show_matplotlib(df, column, max_y):
+	# Only needed for this backend, the plotly backend and run comparison work without matplotlib installed
+	import matplotlib.pyplot as plt
+
+	X = df["#ID"]
+	Y = df[column]
+
 	fig, ax = plt.subplots()
 	sc = plt.scatter(X, Y, color='green')
 
@@ -56,8 +143,8 @@ def show_plot(column="Sum", items=999, csvfile="onactionstats.csv", minimum_valu
 	plt.xticks([])
 	fig.canvas.mpl_connect("motion_notify_event", hover)
 
-	red_threshold = 2.5
-	yellow_threshold = 1.0
+	red_threshold = RED_THRESHOLD
+	yellow_threshold = YELLOW_THRESHOLD
 
 	x_red_dots = X[Y >= red_threshold]
 	y_red_dots = Y[Y >= red_threshold]
@@ -70,6 +157,140 @@ def show_plot(column="Sum", items=999, csvfile="onactionstats.csv", minimum_valu
 	plt.show()
 
 
+def load_runs(csvfiles, column="Sum"):
+	"""Returns the sorted event ids and a float32 array of shape [runs, events] with the column of every run, 0 where an event didn't fire."""
+	frames = [pd.read_csv(x, sep=";", usecols=["#ID", column], dtype={"#ID": str, column: "float32"}) for x in csvfiles]
+	if not frames:
+		return np.array([], dtype=str), np.zeros((0, 0), dtype=np.float32)
+
+	ids, inverse = np.unique(np.concatenate([x["#ID"].to_numpy(dtype=str) for x in frames]), return_inverse=True)
+	values = np.zeros((len(frames), len(ids)), dtype=np.float32)
+	start = 0
+	for i, frame in enumerate(frames):
+		end = start + len(frame)
+		values[i, inverse[start:end]] = frame[column].to_numpy()
+		start = end
+	return ids, values
+
+
+def merge_runs(ids_a, values_a, ids_b, values_b):
+	"""Stack the runs of two sets of runs with different events."""
+	ids, inverse = np.unique(np.concatenate([ids_a, ids_b]), return_inverse=True)
+	values = np.zeros((len(values_a) + len(values_b), len(ids)), dtype=np.float32)
+	values[:len(values_a), inverse[:len(ids_a)]] = values_a
+	values[len(values_a):, inverse[len(ids_a):]] = values_b
+	return ids, values
+
+
+def get_run_key(csvfile):
+	"""Returns the sha1 of a csv file, the same run copied somewhere else gets the same key."""
+	digest = hashlib.sha1()
+	with open(csvfile, "rb") as file:
+		for block in iter(lambda: file.read(1 << 20), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+
+def update_store(store, csvfiles, column="Sum"):
+	"""Add the csv files that aren't in the .npz store yet, returns the run keys, event ids and values of every run in the store."""
+	runs = np.array([], dtype=str)
+	ids = np.array([], dtype=str)
+	values = np.zeros((0, 0), dtype=np.float32)
+	# np.savez_compressed adds .npz to paths without it, so the store has to be read from the same name
+	if store and not store.endswith(".npz"):
+		store += ".npz"
+	if store and os.path.exists(store):
+		with np.load(store, allow_pickle=False) as data:
+			if "version" not in data or int(data["version"]) != STORE_VERSION:
+				raise SystemExit(f"{store} was made by an older version of this script, delete it to start a new store")
+			if str(data["column"]) != column:
+				raise SystemExit(f"{store} holds the {data['column']} column, not {column}")
+			runs, ids, values = data["runs"], data["ids"], data["values"]
+
+	known = set(runs)
+	new_files = list()
+	new_runs = list()
+	for csvfile in csvfiles:
+		key = get_run_key(csvfile)
+		if key not in known:
+			known.add(key)
+			new_files.append(csvfile)
+			new_runs.append(key)
+
+	if new_files:
+		new_ids, new_values = load_runs(new_files, column)
+		ids, values = merge_runs(ids, values, new_ids, new_values)
+		runs = np.concatenate([runs, new_runs])
+		if store:
+			np.savez_compressed(store, version=STORE_VERSION, column=column, runs=runs, ids=ids, values=values)
+	return runs, ids, values
+
+
+def aggregate_runs(ids, values, baseline=None):
+	"""
+	Returns a DataFrame with the mean, 95th percentile and trend (change per run) of every event.
+	Events that crossed the yellow or red threshold compared to the baseline, the mean of every event in the baseline runs, are flagged.
+	"""
+	mean = values.mean(axis=0)
+	p95 = np.percentile(values, 95, axis=0)
+
+	# Least squares slope of every event over the run order
+	x = np.arange(len(values), dtype=np.float64)
+	x -= x.mean()
+	variance = (x ** 2).sum()
+	trend = (x @ (values - mean)) / variance if variance else np.zeros(len(ids))
+
+	if baseline is None:
+		baseline = values[0]
+	flag = np.full(len(ids), "", dtype=object)
+	flag[(mean >= YELLOW_THRESHOLD) & (baseline < YELLOW_THRESHOLD)] = "yellow"
+	flag[(mean >= RED_THRESHOLD) & (baseline < RED_THRESHOLD)] = "red"
+
+	df = pd.DataFrame({"#ID": ids, "Baseline": baseline, "Mean": mean, "P95": p95, "Trend": trend, "Flag": flag})
+	return df.sort_values("Mean", ascending=False).reset_index(drop=True)
+
+
+def compare_runs(csvfiles, column="Sum", baseline_files=None, store=None, out=None):
+	"""Print the events that regressed past a threshold in the runs, returns the number of regressed events."""
+	runs, ids, values = update_store(store, csvfiles, column)
+	if not len(runs):
+		raise SystemExit("There are no runs to compare")
+
+	baseline = None
+	if baseline_files:
+		base_ids, base_values = load_runs(baseline_files, column)
+		baseline = np.zeros(len(ids), dtype=np.float32)
+		indexes = pd.Index(base_ids).get_indexer(ids)
+		found = indexes >= 0
+		baseline[found] = base_values.mean(axis=0)[indexes[found]]
+
+	df = aggregate_runs(ids, values, baseline)
+	if out:
+		df.to_csv(out, sep=";", index=False, float_format="%g")
+
+	regressed = df[df["Flag"] != ""]
+	print(f"{len(runs)} runs, {len(ids)} events, {len(regressed)} regressed past {YELLOW_THRESHOLD}/{RED_THRESHOLD} {column}")
+	if len(regressed):
+		print(regressed.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+	return len(regressed)
+
+
 if __name__ == '__main__':
-	#show_plot(csvfile="onactionstats.csv")
-	show_plot(csvfile="eventstats.csv")
+	parser = argparse.ArgumentParser(description="Plot Imperator Rome event stats or compare the stats of many runs.")
+	parser.add_argument("-csv", help="The stats file to plot.", default="eventstats.csv")
+	parser.add_argument("-column", help="The column to plot or compare.", default="Sum")
+	parser.add_argument("-items", help="The number of events to plot, 0 plots every event.", type=int, default=999)
+	parser.add_argument("-min", help="Events below this value are not plotted.", type=float, default=0.2)
+	parser.add_argument("-backend", help="Plot in the browser with plotly (WebGL) or in a matplotlib window.", choices=["plotly", "matplotlib"], default="plotly")
+	parser.add_argument("-html", help="Write the plotly plot to this html file instead of opening it.")
+	parser.add_argument("-runs", help="Compare these stats files instead of plotting, in the order the runs were made.", nargs="+")
+	parser.add_argument("-baseline", help="The stats files regressions are measured against. Defaults to the first run.", nargs="+")
+	parser.add_argument("-store", help="A .npz file the runs are added to, runs already in it are not loaded again. .npz is added to names without it.")
+	parser.add_argument("-out", help="Write the mean, p95 and trend of every event to this csv file.")
+	args = parser.parse_args()
+
+	if args.runs or args.store:
+		if compare_runs(args.runs or [], args.column, args.baseline, args.store, args.out):
+			raise SystemExit(1)
+	else:
+		show_plot(column=args.column, items=args.items, csvfile=args.csv, minimum_value=args.min, backend=args.backend, html=args.html)
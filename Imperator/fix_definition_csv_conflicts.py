@@ -1,4 +1,8 @@
+import os
+import argparse
+import numpy as np
 import pandas as pd
+from PIL import Image
 
 # Check for color conflicts in definition.csv file
 # Make sure the top of the file is formatted like this or it won't work
@@ -7,25 +11,154 @@ import pandas as pd
 1;42;3;128;Roma;x;;;;;;;;;;;;;;;;;;;
 2;84;6;1;Tiber;x;;;;;;;;;;;;;;;;;;;
 3;126;9;129;Satricum;x;;;;;;;;;;;;;;;;;;;
+
+Find conflicts: python fix_definition_csv_conflicts.py -csv definition.csv
+Give every duplicated color after the first a new unique color: python fix_definition_csv_conflicts.py -csv definition.csv -fix
+With -map the new colors also avoid every color painted in provinces.png
+The provinces that got a new color still have to be painted with it in provinces.png
+Check that definition.csv and the map use the same colors: python fix_definition_csv_conflicts.py -csv definition.csv -map provinces.png -areas areas.csv
 """
 
-def fix_conflicts(csvfile=""):
-	data = pd.read_csv(csvfile, sep=";")
-	df = pd.DataFrame(data)
-	r_column = df.iloc[:, 1]
-	g_column = df.iloc[:, 2]
-	b_column = df.iloc[:, 3]
-	merged_list = zip(r_column, g_column, b_column)
-	color_list = [i for i in merged_list]
+# Odd step through the 24 bit color space, visits every color once and spreads consecutive new colors apart
+COLOR_STRIDE = 0x9E3779
+# Black and white are never handed out as new colors
+RESERVED_COLORS = {0x000000, 0xFFFFFF}
+
+
+def load_definition(csvfile):
+	"""Returns a DataFrame with the id, r, g, b, packed color and file line of every province in definition.csv."""
+	data = pd.read_csv(csvfile, sep=";", header=None, skiprows=1, usecols=[0, 1, 2, 3], skip_blank_lines=False, encoding="latin-1")
+	df = pd.DataFrame({"id": data[0], "r": data[1], "g": data[2], "b": data[3]})
+	# The first line is the header, row i is on line i + 2
+	df["line"] = np.arange(len(df)) + 2
+	df = df.dropna().astype({"id": np.int64, "r": np.int64, "g": np.int64, "b": np.int64})
+	df["color"] = pack_colors(df["r"].to_numpy(), df["g"].to_numpy(), df["b"].to_numpy())
+	return df.reset_index(drop=True)
+
+
+def pack_colors(r, g, b):
+	return (r.astype(np.uint32) << 16) | (g.astype(np.uint32) << 8) | b.astype(np.uint32)
+
+
+def unpack_color(color):
+	return (color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF
+
+
+def find_conflicts(df):
+	"""Returns the rows that use a color an earlier row already uses, with the line of that earlier row."""
+	duplicated = df["color"].duplicated(keep="first").to_numpy()
+	first_lines = df.drop_duplicates("color").set_index("color")["line"]
+	conflicts = df[duplicated].copy()
+	conflicts["first_line"] = first_lines.reindex(conflicts["color"]).to_numpy()
+	return conflicts
+
+
+def get_new_colors(used, count):
+	"""Returns count colors that aren't in used."""
+	used = set(int(x) for x in used) | RESERVED_COLORS
+	colors = list()
+	candidate = 0
+	while len(colors) < count:
+		candidate = (candidate + COLOR_STRIDE) & 0xFFFFFF
+		if candidate not in used:
+			used.add(candidate)
+			colors.append(candidate)
+	return colors
+
+
+def write_colors(csvfile, out, new_colors):
+	"""Copy definition.csv to out with the colors of some lines replaced, new_colors is a dict of line -> packed color."""
+	with open(csvfile, "rb") as file:
+		lines = file.read().split(b"\n")
+
+	for line, color in new_colors.items():
+		fields = lines[line - 1].split(b";")
+		fields[1:4] = [str(x).encode() for x in unpack_color(color)]
+		lines[line - 1] = b";".join(fields)
+
+	temp = out + ".tmp"
+	with open(temp, "wb") as file:
+		file.write(b"\n".join(lines))
+	os.replace(temp, out)
+
 
-	color_list_2 = []
-	for i, color in enumerate(color_list):
-		if color not in color_list_2:
-			color_list_2.append(color)
-		else:
-			print(f"{color} is duplicated on line: {i + 2}")
+def fix_conflicts(csvfile="", fix=False, out=None, mapfile=None):
+	"""Report the color conflicts in definition.csv and give them new colors with fix, new colors never reuse a color painted in the mapfile."""
+	df = load_definition(csvfile)
+	conflicts = find_conflicts(df)
+
+	for row in conflicts.itertuples():
+		print(f"{(row.r, row.g, row.b)} is duplicated on line: {row.line} (first used on line {row.first_line})")
+
+	if not fix or conflicts.empty:
+		print(f"{len(conflicts)} color conflicts in {len(df)} provinces")
+		return conflicts
+
+	used = df["color"].to_numpy()
+	if mapfile:
+		# Colors of orphaned regions in the map would merge with the province that gets them
+		used = np.concatenate([used, np.flatnonzero(load_map_counts(mapfile))])
+	new_colors = dict(zip(conflicts["line"], get_new_colors(used, len(conflicts))))
+	for row in conflicts.itertuples():
+		print(f"Province {row.id} on line {row.line}: {(row.r, row.g, row.b)} -> {unpack_color(new_colors[row.line])}")
+
+	out = out or csvfile
+	write_colors(csvfile, out, new_colors)
+	print(f"Gave {len(conflicts)} provinces a new color in {out}")
+	return conflicts
+
+
+def load_map_counts(mapfile):
+	"""Returns the number of pixels of every packed color in provinces.png, as an array indexed by color."""
+	image = Image.open(mapfile)
+	if image.mode != "RGB":
+		image = image.convert("RGB")
+	pixels = np.asarray(image)
+
+	packed = pixels[:, :, 0].astype(np.uint32)
+	packed <<= 8
+	packed |= pixels[:, :, 1]
+	packed <<= 8
+	packed |= pixels[:, :, 2]
+
+	# Counting every possible color is a single pass, sorting the pixels with np.unique is a lot slower on big maps
+	return np.bincount(packed.ravel(), minlength=1 << 24)
+
+
+def check_map(csvfile, mapfile, areas=None):
+	"""Report colors in provinces.png that aren't in definition.csv and definitions that aren't used in the map."""
+	df = load_definition(csvfile)
+	counts = load_map_counts(mapfile)
+	map_name = os.path.basename(mapfile)
+
+	defined = np.zeros(1 << 24, dtype=bool)
+	defined[df["color"].to_numpy()] = True
+	colors = np.flatnonzero(counts)
+	orphaned = colors[~defined[colors]]
+	for color in orphaned:
+		print(f"{unpack_color(int(color))} is used by {counts[color]} pixels in {map_name} but isn't in definition.csv")
+
+	df["pixels"] = counts[df["color"].to_numpy()]
+	unused = df[df["pixels"] == 0]
+	for row in unused.itertuples():
+		print(f"Province {row.id} on line {row.line} {(row.r, row.g, row.b)} isn't used in {map_name}")
+
+	if areas:
+		df[["id", "r", "g", "b", "pixels"]].to_csv(areas, sep=";", index=False)
+
+	print(f"{len(orphaned)} colors missing from definition.csv, {len(unused)} unused definitions, {len(colors)} colors in the map")
+	return df
 
-	li = df.values.tolist()
 
 if __name__ == '__main__':
-	fix_conflicts(csvfile="definition.csv")
+	parser = argparse.ArgumentParser(description="Find and fix provinces that share a color in definition.csv.")
+	parser.add_argument("-csv", help="The definition.csv file to check.", default="definition.csv")
+	parser.add_argument("-fix", help="Give every duplicated color after the first a new unique color.", action="store_true")
+	parser.add_argument("-out", help="Where the fixed definition.csv is written. Defaults to overwriting the input.")
+	parser.add_argument("-map", help="Also check definition.csv against this provinces.png.")
+	parser.add_argument("-areas", help="Write the pixel area of every province in the -map to this csv file.")
+	args = parser.parse_args()
+
+	fix_conflicts(csvfile=args.csv, fix=args.fix, out=args.out, mapfile=args.map)
+	if args.map:
+		check_map((args.out or args.csv) if args.fix else args.csv, args.map, args.areas)
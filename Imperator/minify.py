@@ -1,14 +1,47 @@
 import os
+import io
+import re
+import json
+import codecs
+import itertools
+import time
+import hashlib
+import bisect
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 """
     Minify Imperator script files or folders
-    Removes all comments and line breaks also doens't allow any double spaces
+    Removes all comments, line breaks and every space that isn't needed to separate two words, strings are kept as they are
     Line breaks are still allowed for event namespaces because they don't work without them
+    Files are read in chunks so large files are minified with constant memory
     The on_action folder is skipped because minifying on_action files breaks the game
 
+    Folders are minified in parallel and a manifest of the input hashes is kept next to the output folder
+    (output.minify_manifest.json for -out output), files that didn't change since the last run are skipped.
+
     You probably don't want to run this script from inside of your mod folder as it will do some funky things.
+
+    With -pack the files of the given directories are merged into fewer files, which means fewer files to open when the game starts.
+    The game loads mod and vanilla files together in alphabetical order, so -pack needs the -game folder:
+    a pack is split wherever a vanilla file sorts between two mod files and files that override a vanilla file by name are never packed.
+    The byte range every file ended up at is written to output.pack_manifest.json next to the output folder for debugging.
+
+    Usage: python minify.py -path "path/to/your/mod" -out output -jobs 0
+    Pack directories: python minify.py -path "path/to/your/mod" -out output -game "path/to/ImperatorRome/game" -pack common/scripted_triggers
 """
 
+# Bump this whenever minify_text changes so every file is minified again
+MINIFIER_VERSION = 2
+# Appended to the output folder name, the manifests are kept outside of the folder so they don't ship with the mod
+MANIFEST_FILE = ".minify_manifest.json"
+PACK_MANIFEST_FILE = ".pack_manifest.json"
+CHUNK_SIZE = 1 << 20
+
+# Words, strings, operators and braces and comments, whitespace between them is skipped
+TOKEN_RE = re.compile(r'[^\s{}=<>!?"#]+|"(?:[^"\\\n]|\\.)*"?|[<>!?]?=|[<>{}!?]|#[^\n]*')
+OPERATORS = set("{}=<>!?")
+
 included_directories = [
     "common",
     "culture_decisions",
@@ -20,28 +53,74 @@ included_directories = [
 
 
 def minify_text(text):
-    lines = text.splitlines()
+    return "".join(minify_stream([text]))
 
-    minified_lines = [
-        " ".join(line.split("#")[0].split()) for line in lines if line.split("#")[0].strip() != ""
-    ]
 
-    minified_lines = list(
-        map(
-            lambda line: line.replace("namespace", "\nnamespace") + "\n" if "namespace" in line else line,
-            minified_lines,
-        )
-    )
+def minify_stream(chunks):
+    """
+    Minify script text read in chunks, yields the minified text of each chunk.
+    Only whitespace next to operators and braces is dropped, strings are copied exactly as they are.
+    """
+    rest = ""
+    separate = False  # The last token was a word or string, the next one has to be separated from it
+    namespace = 0  # 1 after the namespace key, 2 after its =
+    started = False
+    for chunk in itertools.chain(chunks, [None]):
+        text = rest + (chunk or "")
+        # No token except whitespace crosses a line break, so everything up to the last one can be minified now
+        end = text.rfind("\n") + 1 if chunk is not None else len(text)
+        rest = text[end:]
+
+        output = list()
+        append = output.append
+        for value in TOKEN_RE.findall(text, 0, end):
+            first = value[0]
+            if first == "#":
+                continue
+
+            if first in OPERATORS:
+                if namespace:
+                    namespace = 2 if namespace == 1 and value == "=" else 0
+                append(value)
+                separate = False
+            elif namespace == 0 and value != "namespace":
+                append(" " + value if separate else value)
+                separate = True
+            elif namespace == 2:
+                append(" " + value + "\n" if separate else value + "\n")
+                namespace = 0
+                separate = False
+            elif value == "namespace":
+                # Event namespaces only work on their own line
+                append("\nnamespace" if started or output else value)
+                namespace = 1
+                separate = True
+            else:
+                append(" " + value if separate else value)
+                namespace = 0
+                separate = True
 
-    return " ".join(minified_lines)
+        started = started or bool(output)
+        yield "".join(output)
 
 
-def minify_all(input_dir):
-    output_dir = "output"
+def minify_all(input_dir, output_dir="output", jobs=1, pack_directories=(), game_dir=None):
+    """
+    Minify every included file in input_dir, returns a dict of directory -> [files minified, files skipped, bytes in, bytes out, seconds].
+    The files of each directory in pack_directories are merged into as few files as the vanilla files in game_dir allow, see split_packs,
+    the minified files they are made of are kept in a parts folder next to output_dir.
+    """
+    if pack_directories and game_dir is None:
+        raise ValueError("Packing needs the game folder to keep the load order of mod and vanilla files")
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    pack_directories = {os.path.normpath(x) for x in pack_directories}
+    parts_dir = get_parts_directory(output_dir)
+
+    manifest = load_manifest(output_dir)
+    tasks = list()
     for dirpath, dirnames, filenames in os.walk(input_dir):
         if "on_action" in dirpath:
             continue
@@ -49,41 +128,278 @@ def minify_all(input_dir):
             continue
 
         for filename in [x for x in filenames if x.endswith(".txt")]:
-            filepath = os.path.join(dirpath, filename)
-            with open(filepath, "r", encoding="utf-8-sig") as file:
-                contents = file.read()
+            rel_path = os.path.relpath(os.path.join(dirpath, filename), input_dir)
+            packed = os.path.dirname(rel_path) in pack_directories
+            entry = manifest.get(rel_path, {})
+            # A file that moved in or out of a pack has to be written again
+            old_hash = entry.get("hash") if entry.get("packed", False) == packed else None
+            tasks.append((input_dir, parts_dir if packed else output_dir, rel_path, old_hash))
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(minify_task, tasks, chunksize=16))
+    else:
+        results = [minify_task(x) for x in tasks]
+
+    # Outputs of files that were deleted from the mod would otherwise be shipped forever
+    found = {x[0] for x in results}
+    for rel_path in set(manifest) - found:
+        remove_file(os.path.join(output_dir, rel_path))
+        remove_file(os.path.join(parts_dir, rel_path))
+
+    packs = dict()
+    for rel_path in found:
+        directory = os.path.dirname(rel_path)
+        if directory in pack_directories:
+            packs.setdefault(directory, list()).append(rel_path)
+        else:
+            # Directories that were packed before have to drop their parts
+            remove_file(os.path.join(parts_dir, rel_path))
+
+    old_pack_manifest = load_pack_manifest(output_dir)
+    pack_manifest = dict()
+    for directory, rel_paths in sorted(packs.items()):
+        for group in split_packs(rel_paths, get_vanilla_files(game_dir, directory)):
+            pack_manifest.update(pack_directory(output_dir, parts_dir, group))
+
+    # Remove packs of directories that aren't packed anymore, unless a minified file took their place
+    old_packs = {x["pack"] for x in old_pack_manifest.values()} - {x["pack"] for x in pack_manifest.values()}
+    for pack in old_packs - {x for x in found if os.path.dirname(x) not in pack_directories}:
+        remove_file(os.path.join(output_dir, pack))
+    save_pack_manifest(output_dir, pack_manifest)
+
+    stats = dict()
+    new_manifest = dict()
+    for rel_path, digest, skipped, in_size, out_size, seconds in results:
+        new_manifest[rel_path] = {"hash": digest, "in": in_size, "out": out_size}
+        if os.path.dirname(rel_path) in pack_directories:
+            new_manifest[rel_path]["packed"] = True
+        directory = stats.setdefault(os.path.dirname(rel_path), [0, 0, 0, 0, 0.0])
+        directory[1 if skipped else 0] += 1
+        directory[2] += in_size
+        directory[3] += out_size
+        directory[4] += seconds
+
+    save_manifest(output_dir, new_manifest)
+    return stats
+
+
+def minify_task(task):
+    """Minify a single file of minify_all, returns (rel_path, hash, skipped, bytes in, bytes out, seconds)."""
+    input_dir, output_dir, rel_path, old_hash = task
+    start = time.perf_counter()
+    input_filepath = os.path.join(input_dir, rel_path)
+    sha1 = hashlib.sha1()
+    with open(input_filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            sha1.update(chunk)
+
+    digest = sha1.hexdigest()
+    in_size = os.path.getsize(input_filepath)
+    output_filepath = os.path.join(output_dir, rel_path)
+    if digest == old_hash and os.path.exists(output_filepath):
+        return rel_path, digest, True, in_size, os.path.getsize(output_filepath), time.perf_counter() - start
+
+    # Create a similar directory structure in output_dir
+    os.makedirs(os.path.dirname(output_filepath), exist_ok=True)
+    minify_to_file(input_filepath, output_filepath)
+
+    return rel_path, digest, False, in_size, os.path.getsize(output_filepath), time.perf_counter() - start
+
+
+def minify_to_file(input_filepath, output_filepath):
+    with open(input_filepath, "r", encoding="utf-8-sig") as input_file:
+        with open(output_filepath, "w", encoding="utf-8-sig", newline="\n") as output_file:
+            for text in minify_stream(iter(lambda: input_file.read(CHUNK_SIZE), "")):
+                output_file.write(text)
+
+
+def get_vanilla_files(game_dir, directory):
+    """Returns the sorted names of the vanilla files in a directory of the game folder."""
+    vanilla_dir = os.path.join(game_dir, directory)
+    if not os.path.isdir(vanilla_dir):
+        return []
+    return sorted(x for x in os.listdir(vanilla_dir) if x.endswith(".txt"))
+
+
+def split_packs(rel_paths, vanilla_files):
+    """
+    Split the files of a directory into groups that can be packed without changing the load order.
+    The game loads mod and vanilla files together in alphabetical order, so a group ends wherever a vanilla file sorts
+    between two mod files. Files with the same name as a vanilla file replace it and are always in a group of their own.
+
+    >>> split_packs(["a/00_a.txt", "a/10_b.txt", "a/zz_c.txt", "a/50_x.txt"], ["50_x.txt"])
+    [['a/00_a.txt', 'a/10_b.txt'], ['a/50_x.txt'], ['a/zz_c.txt']]
+    """
+    groups = list()
+    previous = None
+    previous_overrides = False
+    for rel_path in sorted(rel_paths, key=os.path.basename):
+        name = os.path.basename(rel_path)
+        overrides = name in vanilla_files
+        vanilla_between = previous is not None and bisect.bisect_right(vanilla_files, previous) < bisect.bisect_left(vanilla_files, name)
+        if not groups or overrides or previous_overrides or vanilla_between:
+            groups.append([rel_path])
+        else:
+            groups[-1].append(rel_path)
+        previous = name
+        previous_overrides = overrides
+    return groups
+
 
-            minified_contents = minify_text(contents)
+def pack_directory(output_dir, parts_dir, rel_paths):
+    """
+    Merge minified files into one file named after the first file in load order, returns file -> byte range in the pack.
+    Entries are read in the same order as before only if no vanilla file sorts between the files, see split_packs.
+    """
+    rel_paths = sorted(rel_paths, key=os.path.basename)
+    pack = rel_paths[0]
+    for rel_path in rel_paths[1:]:
+        remove_file(os.path.join(output_dir, rel_path))
 
-            # Create a similar directory structure in output_dir
-            rel_dir = os.path.relpath(dirpath, input_dir)
-            output_dirpath = os.path.join(output_dir, rel_dir)
-            if not os.path.exists(output_dirpath):
-                os.makedirs(output_dirpath)
+    ranges = dict()
+    buffer = io.BytesIO()
+    buffer.write(codecs.BOM_UTF8)
+    for rel_path in rel_paths:
+        with open(os.path.join(parts_dir, rel_path), "rb") as file:
+            contents = file.read()
+        if contents.startswith(codecs.BOM_UTF8):
+            contents = contents[len(codecs.BOM_UTF8):]
 
-            with open(os.path.join(output_dirpath, filename), "w", encoding="utf-8-sig") as file:
-                file.write(minified_contents)
+        start = buffer.tell()
+        buffer.write(contents)
+        ranges[rel_path] = {"pack": pack, "start": start, "end": buffer.tell()}
+        # Keeps the last word of a file apart from the first of the next and namespaces on their own line
+        buffer.write(b"\n")
 
+    packed_contents = buffer.getvalue()
+    pack_filepath = os.path.join(output_dir, pack)
+    if os.path.exists(pack_filepath):
+        with open(pack_filepath, "rb") as file:
+            if file.read() == packed_contents:
+                return ranges
 
-def minify_file(input_filepath):
-    output_dir = "output"
+    os.makedirs(os.path.dirname(pack_filepath), exist_ok=True)
+    with open(pack_filepath, "wb") as file:
+        file.write(packed_contents)
+    return ranges
 
+
+def get_parts_directory(output_dir):
+    return os.path.normpath(output_dir) + "_parts"
+
+
+def get_manifest_file(output_dir, name):
+    return os.path.normpath(output_dir) + name
+
+
+def read_manifest_file(output_dir, name):
+    # Manifests used to be written inside the output folder, they are read from there once and then moved out
+    for filepath in (get_manifest_file(output_dir, name), os.path.join(output_dir, name)):
+        if os.path.exists(filepath):
+            with open(filepath, "r", encoding="utf-8") as file:
+                return json.load(file)
+    return dict()
+
+
+def remove_file(filepath):
+    if os.path.exists(filepath):
+        os.remove(filepath)
+
+
+def load_manifest(output_dir):
+    try:
+        manifest = read_manifest_file(output_dir, MANIFEST_FILE)
+    except (OSError, ValueError):
+        return dict()
+
+    if manifest.get("version") != MINIFIER_VERSION:
+        return dict()
+    return manifest["files"]
+
+
+def save_manifest(output_dir, files):
+    remove_file(os.path.join(output_dir, MANIFEST_FILE))
+    with open(get_manifest_file(output_dir, MANIFEST_FILE), "w", encoding="utf-8") as file:
+        json.dump({"version": MINIFIER_VERSION, "files": files}, file, indent=1, sort_keys=True)
+
+
+def load_pack_manifest(output_dir):
+    try:
+        return read_manifest_file(output_dir, PACK_MANIFEST_FILE)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_pack_manifest(output_dir, ranges):
+    remove_file(os.path.join(output_dir, PACK_MANIFEST_FILE))
+    filepath = get_manifest_file(output_dir, PACK_MANIFEST_FILE)
+    if not ranges:
+        remove_file(filepath)
+        return
+
+    with open(filepath, "w", encoding="utf-8") as file:
+        json.dump(ranges, file, indent=1, sort_keys=True)
+
+
+def print_stats(stats, seconds):
+    print(f"{'Directory':<50} {'Minified':>8} {'Skipped':>8} {'Bytes in':>12} {'Bytes saved':>12} {'Seconds':>8}")
+    for directory, (minified, skipped, in_size, out_size, time_spent) in sorted(stats.items()):
+        print(f"{directory:<50} {minified:>8} {skipped:>8} {in_size:>12} {in_size - out_size:>12} {time_spent:>8.2f}")
+
+    total_in = sum(x[2] for x in stats.values())
+    total_saved = total_in - sum(x[3] for x in stats.values())
+    percent = total_saved / total_in * 100 if total_in else 0
+    print(f"Saved {total_saved} of {total_in} bytes ({percent:.1f}%) in {seconds:.2f} seconds")
+
+
+def minify_file(input_filepath, output_dir="output"):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     filename = os.path.basename(input_filepath)
-    with open(input_filepath, "r") as file:
-        contents = file.read()
-
-    minified_contents = minify_text(contents)
-
-    with open(os.path.join(output_dir, filename), "w") as file:
-        file.write(minified_contents)
+    minify_to_file(input_filepath, os.path.join(output_dir, filename))
 
 
 if __name__ == "__main__":
-    # minify_file(
-    #     "/home/nathan/.local/share/Paradox Interactive/Imperator/mod/ImperatorFMO/events/subject_focus_events.txt"
-    # )
+    parser = argparse.ArgumentParser(description="Minify Imperator Rome script files.")
+    parser.add_argument(
+        "-path",
+        help="The mod folder to minify, or a single file.",
+        required=True,
+    )
+    parser.add_argument(
+        "-out",
+        help="The folder minified files are written to.",
+        default="output",
+    )
+    parser.add_argument(
+        "-jobs",
+        help="The number of processes used to minify files. 0 uses every core.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-pack",
+        help="Merge the files of these directories into as few files as the load order allows, needs -game.",
+        nargs="+",
+        default=[],
+    )
+    parser.add_argument(
+        "-game",
+        help="The game folder of Imperator Rome, used to keep the load order of mod and vanilla files when packing.",
+    )
+    args = parser.parse_args()
+
+    if args.pack and not args.game:
+        parser.error("-pack needs -game")
 
-    minify_all("C:\\Users\\demen\\Documents\\Paradox Interactive\\Imperator\\mod\\ImperatorFMO")
+    if os.path.isfile(args.path):
+        minify_file(args.path, args.out)
+    else:
+        start = time.perf_counter()
+        stats = minify_all(args.path, args.out, args.jobs, args.pack, args.game)
+        print_stats(stats, time.perf_counter() - start)
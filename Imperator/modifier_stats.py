@@ -3,16 +3,26 @@ Python command line program to generate plots for analysis of modifier usage in
 This should help to balance out modifiers, compare the overall values of modifiers to other mods/vanilla, and get other insights into the usage of modifiers in your mod.
 Requires both numpy and plotly python packages
 
+Only values directly inside modifier blocks (modifier = { ... }, country_modifier = { ... }, etc...) are counted.
+Modifier blocks used as weights or triggers inside ai_will_do, chance, potential, allow, etc... are ignored.
+
 
 CLI Usage:
 
 `python modifier_stats.py -path "path/to/your/mod/directory"`
 
+`python modifier_stats.py -compare "path/to/game" "path/to/your/mod/directory"`
+
 CLI Arguments:
 
--path: The full path to the mod you want to analyze the modifiers in. This can also be the path to the game files. This is the only required argument.
+-path: The full path to the mod you want to analyze the modifiers in. This can also be the path to the game files. Either -path or -compare is required.
     Example: -path "path/to/your/mod/directory"
 
+-compare: The full paths to several mods and/or the game files to compare, used instead of -path.
+    All of them are scanned together, a table with the totals, deltas against the first path and uses of every modifier is printed
+    and each path gets its own trace in the plot.
+    Example: -compare "path/to/game" "path/to/your/mod/directory" "path/to/another/mod/directory"
+
 -dirs: List of relative paths to directories you want to analyze. Each directory should be seperated by a space.
     Example: -dirs "common/buildings" "common/laws" 
 
@@ -39,24 +49,65 @@ CLI Arguments:
     Example: -max 15
     Default: 10
 
+-jobs: The number of processes used to scan files. Results are merged in file order so the output is the same as with 1 job. 0 uses every core.
+    Example: -jobs 16
+    Default: 1
+
+-cache: The file parse results are cached in. Files are only parsed again when their modification time or size changed.
+    Example: -cache "path/to/cache.sqlite"
+    Default: modifier_stats_cache.sqlite
+
+-nocache: Parse every file without reading or writing the cache.
+    Example: -nocache
+
+-out: Write the results to a file instead of opening the plot in a browser.
+    .csv, .json and .parquet files get the table of modifier totals and uses (parquet needs pandas and pyarrow).
+    .html files get the plot selected with -plot as a single self-contained page.
+    Example: -out "modifier_stats.csv"
+
+-hoverlimit: The maximum number of sources (File - Line - Value) listed when hovering over a modifier, the rest is summarized as "+N more".
+    Keeps the plot small and responsive when modifiers are used thousands of times. 0 lists all of them.
+    Example: -hoverlimit 50
+    Default: 20
+
+-sourceindex: A .json file to write every source of every modifier in the plot to, for when the hover list is truncated.
+    Example: -sourceindex "modifier_sources.json"
+
+-filters: A file with rules for the modifier names that are left out of the analysis, replaces the built in BANNED_LIST and BANNED_PREFIXES.
+    Every line is a `kind: pattern` rule where kind is exact, prefix, suffix or glob. See modifier_filters.txt for the built in rules.
+    Example: -filters "modifier_filters.txt"
+
 """
 
 
 import os
 import re
+import csv
+import fnmatch
+import json
+import pickle
+import sqlite3
 import argparse
-from typing import Dict, List, Any
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
 
 import plotly.graph_objects as go
 import numpy as np
 
 
-DEFAULT_ANALYSIS_DIRS = {
+DEFAULT_ANALYSIS_DIRS = [
     "common\\buildings\\",
     "common\\inventions\\",
     "common\\laws\\",
-}
+]
 
+TABLE_FORMATS = {".csv", ".json", ".parquet"}
+
+DEFAULT_CACHE_FILE = "modifier_stats_cache.sqlite"
+
+# Default ModifierFilter rules, BANNED_LIST are exact names and BANNED_PREFIXES are name prefixes.
+# modifier_filters.txt holds the same rules as a starting point for -filters.
 BANNED_LIST = {
     "max",
     "duration",
@@ -79,62 +130,394 @@ BANNED_LIST = {
     "navy",
     "keystone",
     "multiply",
+    "add",
 }
 
 BANNED_PREFIXES = {
-    "add",
+    "add_",
     "is_",
     "has_",
     "can_",
 }
 
+# Bump whenever parse_modifiers changes so old cache entries are thrown away
+PARSER_VERSION = 2
 
-class ModifierData:
-    def __init__(self, name: str, value: str, file: str, line: int):
-        self.name = name
-        self.file = os.path.basename(file)
-        self.line = line
-        self.value = value
+# Blocks whose direct children are modifiers
+MODIFIER_BLOCKS = {
+    "modifier",
+    "country_modifier",
+    "province_modifier",
+    "state_modifier",
+    "character_modifier",
+    "unit_modifier",
+}
 
+# Blocks where a nested `modifier = { ... }` is a weight or a trigger instead of a real modifier
+EXCLUDED_BLOCKS = {
+    "ai_will_do",
+    "ai_chance",
+    "chance",
+    "weight",
+    "trigger",
+    "potential",
+    "allow",
+    "limit",
+}
+
+STRING_RE = re.compile(r'"[^"\n]*"')
+COMMENT_RE = re.compile(r"#[^\n]*")
+BRACE_RE = re.compile(r"[{}]")
+
+# What has to follow a block key, `= {`
+BLOCK_RE = re.compile(r"\s*=\s*\{")
+# Every modifier block key contains this, files without it can't have modifiers
+MODIFIER_WORD = "modifier"
+# The characters that can come right before a block key
+KEY_SEPARATORS = frozenset(" \t\r\n\f\v{}")
+
+# `name = value` where the value is a number or yes. Groups: 1 name, 2 value
+ASSIGNMENT_RE = re.compile(r"([^\s{}=<>!?]+)\s*=\s*(-?\d+(?:\.\d+)?|yes)(?![^\s{}])")
+
+
+class ModifierFilter:
+    """
+    Decides which modifier names are left out of the analysis.
+    Rules are (kind, pattern) pairs where kind is exact, prefix, suffix or glob.
+    Exact rules are kept in a set and the rest are compiled once into a single anchored regex,
+    the result for every name is remembered so each distinct name is only matched once.
+    """
+
+    __slots__ = ("exact", "regex", "results")
+
+    def __init__(self, rules: List[Tuple[str, str]]):
+        self.exact = set()
+        patterns = list()
+        for kind, pattern in rules:
+            if kind == "exact":
+                self.exact.add(pattern)
+            elif kind == "prefix":
+                patterns.append(re.escape(pattern) + ".*")
+            elif kind == "suffix":
+                patterns.append(".*" + re.escape(pattern))
+            elif kind == "glob":
+                patterns.append(fnmatch.translate(pattern))
+            else:
+                raise ValueError(f"Unknown filter rule type: {kind}")
+        self.regex = re.compile("|".join(patterns)) if patterns else None
+        self.results = dict()
+
+    @classmethod
+    def from_file(cls, filename: str):
+        """
+        Read the rules from a file with a `kind: pattern` rule on every line.
+        Empty lines and lines starting with # are skipped.
+        """
+        rules = list()
+        with open(filename, "r", encoding="utf-8-sig") as file:
+            for i, line in enumerate(file):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                kind, _, pattern = line.partition(":")
+                if not pattern.strip():
+                    raise ValueError(f"{filename} line {i + 1}: expected `kind: pattern`")
+                rules.append((kind.strip().lower(), pattern.strip()))
+        return cls(rules)
+
+    @classmethod
+    def default(cls):
+        return cls(
+            [("exact", x) for x in sorted(BANNED_LIST)]
+            + [("prefix", x) for x in sorted(BANNED_PREFIXES)]
+        )
+
+    def is_banned(self, name: str):
+        banned = self.results.get(name)
+        if banned is None:
+            banned = name in self.exact or (
+                self.regex is not None and self.regex.fullmatch(name) is not None
+            )
+            self.results[name] = banned
+        return banned
+
+
+class ModifierStore:
+    """
+    Columnar store of every modifier occurrence.
+    Modifier names and files are interned, occurrence i is described by name_ids[i], file_ids[i], lines[i] and values[i].
+    Every file belongs to a source (a game or mod directory), file_sources[file_id] is the index of its source in sources.
+    Rows are added with add_file and the columns become numpy arrays once finalize is called.
+    """
+
+    __slots__ = (
+        "names",
+        "files",
+        "sources",
+        "file_sources",
+        "name_ids",
+        "file_ids",
+        "lines",
+        "values",
+        "name_index",
+        "modifier_filter",
+        "grouped_rows",
+        "group_starts",
+    )
 
-class Modifier:
     def __init__(
-        self, name: str, total_value: float, modifier_data: List[ModifierData]
+        self,
+        files: List[str],
+        sources: List[str],
+        file_sources: List[int],
+        modifier_filter: ModifierFilter,
     ):
-        self.name = name
-        self.total_value = round(total_value, 2)
-        self.modifier_data = modifier_data
-        self.total_uses = len(modifier_data)
-
-    def print(self):
-        print(f"Modifier Name: {self.name}\nModifier Value: {self.total_value}\n")
-
-    def get_modifier_data_string(self):
-        string = str()
-        for i in self.modifier_data:
-            string += f"File: {i.file} - Line: {i.line} - Value: {i.value}<br>"
+        self.names = list()
+        self.files = files
+        self.sources = sources
+        self.file_sources = np.array(file_sources, dtype=np.int32)
+        self.name_index = dict()
+        self.modifier_filter = modifier_filter
+        self.name_ids = array("i")
+        self.file_ids = array("i")
+        self.lines = array("i")
+        self.values = array("f")
+        self.grouped_rows = None
+        self.group_starts = None
+
+    def add_file(self, file_id: int, modifiers):
+        names = self.names
+        name_index = self.name_index
+        is_banned = self.modifier_filter.is_banned
+        for name, value, line in modifiers:
+            if is_banned(name):
+                continue
+            name_id = name_index.get(name)
+            if name_id is None:
+                name_id = name_index[name] = len(names)
+                names.append(name)
+            self.name_ids.append(name_id)
+            self.file_ids.append(file_id)
+            self.lines.append(line)
+            self.values.append(1.0 if value == "yes" else float(value))
+
+    def finalize(self):
+        self.name_ids = np.frombuffer(self.name_ids, dtype=np.int32)
+        self.file_ids = np.frombuffer(self.file_ids, dtype=np.int32)
+        self.lines = np.frombuffer(self.lines, dtype=np.int32)
+        self.values = np.frombuffer(self.values, dtype=np.float32)
+
+    def get_totals(self):
+        """Get the total value and the number of uses of every modifier in every source, indexed by [source id, name id]."""
+        shape = (len(self.sources), len(self.names))
+        groups = self.file_sources[self.file_ids].astype(np.int64) * shape[1] + self.name_ids
+        totals = np.bincount(groups, weights=self.values, minlength=shape[0] * shape[1])
+        uses = np.bincount(groups, minlength=shape[0] * shape[1])
+        return (np.round(totals.reshape(shape), 2), uses.reshape(shape))
+
+    def get_rows(self, name_id: int):
+        """Get the rows of every occurrence of a modifier in the order they were found."""
+        if self.grouped_rows is None:
+            self.grouped_rows = np.argsort(self.name_ids, kind="stable")
+            self.group_starts = np.searchsorted(
+                self.name_ids[self.grouped_rows], np.arange(len(self.names) + 1)
+            )
+        return self.grouped_rows[
+            self.group_starts[name_id] : self.group_starts[name_id + 1]
+        ]
+
+    def get_source_rows(self, name_id: int, source_id: int = 0):
+        """Get the rows of every occurrence of a modifier in a single source."""
+        rows = self.get_rows(name_id)
+        if len(self.sources) > 1:
+            rows = rows[self.file_sources[self.file_ids[rows]] == source_id]
+        return rows
+
+    def get_occurrences(self, rows):
+        return zip(
+            [self.files[x] for x in self.file_ids[rows].tolist()],
+            self.lines[rows].tolist(),
+            self.values[rows].tolist(),
+        )
+
+    def get_modifier_data_string(
+        self, name_id: int, source_id: int = 0, limit: int = 0, more_text: str = ""
+    ):
+        """
+        Get the hover text listing the occurrences of a modifier.
+        With a limit only the first limit occurrences are listed followed by a "+N more" summary.
+        """
+        rows = self.get_source_rows(name_id, source_id)
+        hidden = 0
+        if limit and len(rows) > limit:
+            hidden = len(rows) - limit
+            rows = rows[:limit]
+        string = "".join(
+            f"File: {os.path.basename(file)} - Line: {line} - Value: {value:g}<br>"
+            for file, line, value in self.get_occurrences(rows)
+        )
+        if hidden:
+            string += f"+{hidden} more{more_text}<br>"
         return string
 
 
-base_modifiers: Dict[str, List[ModifierData]]
-base_modifiers = dict()
+class ParseCache:
+    """
+    On-disk sqlite cache of the modifiers parsed from each file.
+    Entries are keyed by the absolute file path and are only used while the mtime and size of the file are unchanged.
+    The cache mirrors the files of the last scan, entries of files that weren't scanned are removed.
+    The whole cache is dropped when the parser or the block definitions change.
+    """
 
+    def __init__(self, filename: str):
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, modifiers BLOB)"
+        )
+        version = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        if version is None or version[0] != get_cache_version():
+            self.connection.execute("DELETE FROM files")
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                (get_cache_version(),),
+            )
+            self.connection.commit()
 
-def get_filtered_data(modifier_data, filter_by, minimum, maximum):
-    filtered_data = [
-        x
-        for x in modifier_data
-        if float(minimum) <= getattr(x, f"total_{filter_by}") <= float(maximum)
-    ]
+        # Load every entry with a single query, looking them up one at a time is a lot slower
+        self.entries = {
+            path: (mtime, size, modifiers)
+            for path, mtime, size, modifiers in self.connection.execute(
+                "SELECT path, mtime, size, modifiers FROM files"
+            )
+        }
+
+    def get(self, filepath: str, stat: os.stat_result):
+        entry = self.entries.get(os.path.abspath(filepath))
+        if entry is None:
+            return None
+        if entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+            return None
+        return pickle.loads(entry[2])
+
+    def put(self, parsed_files, scanned_files):
+        """
+        Store (filepath, stat, modifiers) tuples and remove the entries of files that aren't in scanned_files.
+        The stat has to be taken before the file is parsed, so a file saved while it was parsed is parsed again next time.
+        """
+        rows = list()
+        for filepath, stat, modifiers in parsed_files:
+            rows.append(
+                (
+                    os.path.abspath(filepath),
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                    pickle.dumps(modifiers, pickle.HIGHEST_PROTOCOL),
+                )
+            )
+        removed = set(self.entries) - {os.path.abspath(x) for x in scanned_files}
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM files WHERE path = ?", [(x,) for x in removed]
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", rows
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+def get_cache_version():
+    # Everything that changes the output of parse_modifiers has to be part of the version
+    return ";".join(
+        (
+            str(PARSER_VERSION),
+            ",".join(sorted(MODIFIER_BLOCKS)),
+            ",".join(sorted(EXCLUDED_BLOCKS)),
+        )
+    )
+
+
+def get_filtered_ids(modifier_store, filter_by, minimum, maximum):
+    """Get the ids of the modifiers whose total value/uses is between minimum and maximum in at least one source."""
+    totals, uses = modifier_store.get_totals()
+    column = totals if filter_by == "value" else uses
+    return np.flatnonzero(
+        ((float(minimum) <= column) & (column <= float(maximum))).any(axis=0)
+    )
 
-    names = [x.name for x in filtered_data]
-    values = [x.total_value for x in filtered_data]
-    uses = [x.total_uses for x in filtered_data]
-    sources = [x.get_modifier_data_string() for x in filtered_data]
+
+def get_filtered_data(
+    modifier_store,
+    filter_by,
+    minimum,
+    maximum,
+    source_id=0,
+    hover_limit=0,
+    source_index=None,
+):
+    totals, uses = modifier_store.get_totals()
+    totals = totals[source_id]
+    uses = uses[source_id]
+    keep = get_filtered_ids(modifier_store, filter_by, minimum, maximum)
+    keep = keep[uses[keep] > 0]
+
+    names = [modifier_store.names[i] for i in keep]
+    values = totals[keep].tolist()
+    uses = uses[keep].tolist()
+    more_text = f" in {os.path.basename(source_index)}" if source_index else ""
+    sources = [
+        modifier_store.get_modifier_data_string(i, source_id, hover_limit, more_text)
+        for i in keep
+    ]
 
     return (names, values, uses, sources)
 
 
+def get_modifier_table(modifier_store, filter_by, minimum, maximum):
+    """
+    Join the totals of every source into a single table with a row per modifier that passes the filter.
+    Deltas are the difference between the total value in a source and the total value in the first source.
+    Returns the column names and the rows.
+    """
+    totals, uses = modifier_store.get_totals()
+    keep = get_filtered_ids(modifier_store, filter_by, minimum, maximum)
+    deltas = np.round(totals - totals[0], 2)
+
+    columns = ["Modifier"]
+    for i, source in enumerate(modifier_store.sources):
+        columns.append(f"{source} Value")
+        if i > 0:
+            columns.append(f"{source} Delta")
+        columns.append(f"{source} Uses")
+
+    rows = list()
+    for name_id in keep:
+        row = [modifier_store.names[name_id]]
+        for i in range(len(modifier_store.sources)):
+            row.append(totals[i, name_id].item())
+            if i > 0:
+                row.append(deltas[i, name_id].item())
+            row.append(uses[i, name_id].item())
+        rows.append(row)
+    return (columns, rows)
+
+
+def print_table(columns, rows):
+    widths = [len(x) for x in columns]
+    for row in rows:
+        for i, x in enumerate(row):
+            widths[i] = max(widths[i], len(str(x)))
+    print("  ".join(x.ljust(widths[i]) for i, x in enumerate(columns)))
+    for row in rows:
+        print("  ".join(str(x).ljust(widths[i]) for i, x in enumerate(row)))
+
+
 def get_hover_template(customdata):
     return (
         "<b>Name</b>: %{customdata[0]}<br>"
@@ -167,154 +550,412 @@ def get_color(value, max_value):
 
 
 class Plots:
-    def __init__(self, modifier_data, dirname, args):
-        d = get_filtered_data(modifier_data, args.filterby, args.min, args.max)
-        customdata = np.stack((d[0], d[1], d[2], d[3]), axis=-1)
-        dirname = dirname.title()
-        if dirname == "Game":
-            dirname = "Base Game"
-        self.Vbar = (
+    """Builds the trace and layout arguments of a plot, only the plot type that is requested gets built."""
+
+    def __init__(self, modifier_store, title, args, source_id=0):
+        self.d = get_filtered_data(
+            modifier_store,
+            args.filterby,
+            args.min,
+            args.max,
+            source_id,
+            args.hoverlimit,
+            args.sourceindex,
+        )
+        self.customdata = list(zip(*self.d))
+        self.name = modifier_store.sources[source_id]
+        self.title = title
+        self.args = args
+
+    def Vbar(self):
+        d = self.d
+        return (
             go.Bar,
             {
-                "y": d[1],
+                "name": self.name,
+                "y": d[2] if self.args.sortby.lower() == "uses" else d[1],
                 "x": d[0],
-                "customdata": customdata,
-                "hovertemplate": get_hover_template(customdata),
+                "customdata": self.customdata,
+                "hovertemplate": get_hover_template(self.customdata),
             },
             {
-                "xaxis": {"title": f"Total Modifier {args.sortby.title()}"},
+                "xaxis": {"title": f"Total Modifier {self.args.sortby.title()}"},
                 "yaxis": {"title": f"Modifier Names"},
-                "title": f"{dirname} Modifier Values Bar Plot",
+                "title": f"{self.title} Modifier Values Bar Plot",
             },
         )
-        self.Scatter = (
+
+    def Scatter(self):
+        d = self.d
+        return (
             go.Scatter,
             {
+                "name": self.name,
                 "y": d[0],
-                "x": d[1],
-                "customdata": customdata,
+                "x": d[2] if self.args.sortby.lower() == "uses" else d[1],
+                "customdata": self.customdata,
                 "mode": "markers",
                 "marker": {"size": 15},
-                "hovertemplate": get_hover_template(customdata),
+                "hovertemplate": get_hover_template(self.customdata),
             },
             {
-                "xaxis": {"title": f"Total Modifier {args.sortby.title()}"},
+                "xaxis": {"title": f"Total Modifier {self.args.sortby.title()}"},
                 "yaxis": {"title": f"Modifier Names"},
-                "title": f"{dirname} Modifier Values Scatter Plot",
+                "title": f"{self.title} Modifier Values Scatter Plot",
             },
         )
+
+    def Bubble(self):
+        d = self.d
         size = [abs(x) for x in d[1]]
-        self.Bubble = (
+        return (
             go.Scatter,
             {
+                "name": self.name,
                 "y": d[0],
-                "x": d[1],
-                "customdata": customdata,
-                "hovertemplate": get_hover_template(customdata),
+                "x": d[2] if self.args.sortby.lower() == "uses" else d[1],
+                "customdata": self.customdata,
+                "hovertemplate": get_hover_template(self.customdata),
                 "mode": "markers",
                 "marker": dict(
                     size=size,
-                    color=[get_color(x, float(args.max)) for x in d[1]],
+                    color=[get_color(x, float(self.args.max)) for x in d[1]],
                     sizemode="area",
-                    sizeref=2.0 * max(size) / (40.0**2),
+                    sizeref=2.0 * max(size, default=1) / (40.0**2),
                     sizemin=4,
                 ),
             },
             {
-                "xaxis": {"title": f"Total Modifier {args.sortby}"},
+                "xaxis": {"title": f"Total Modifier {self.args.sortby}"},
                 "yaxis": {"title": f"Modifier Names"},
-                "title": f"{dirname} Modifier Values Bubble Plot",
+                "title": f"{self.title} Modifier Values Bubble Plot",
             },
         )
-        if args.sortby.lower() == "uses":
-            self.Bubble[1]["x"] = d[2]
-            self.Scatter[1]["x"] = d[2]
-            self.Vbar[1]["y"] = d[2]
-
-
-def get_last_directory_name(path):
-    normalized_path = os.path.normpath(path)
-    last_directory_name = os.path.basename(normalized_path)
-    return last_directory_name
-
-
-def update_modifiers(modifiers) -> List[Modifier]:
-    x = list()
-    for i in modifiers:
-        total_value = 0
-        for j in modifiers[i]:
-            value = int()
-            if j.value == "yes":
-                value = 1
-            else:
-                value = j.value
-            total_value += float(value)
-        x.append(Modifier(i, total_value, modifiers[i]))
-    return x
-
 
-def main(args):
-    found_files = dict()
-    path = args.path
-    if not path.endswith("\\"):
-        path += "\\"
-    for i in args.dirs:
-        if not i.endswith("\\"):
-            i += "\\"
-        found_files[i] = [path + i + x for x in os.listdir(path + i)]
 
-    for i in found_files:
-        for j in found_files[i]:
-            handle_file(j)
+def get_plot_title(dirname):
+    dirname = dirname.title()
+    if dirname == "Game":
+        dirname = "Base Game"
+    return dirname
 
-    base_modifier_data = update_modifiers(base_modifiers)
-    plot1 = Plots(base_modifier_data, get_last_directory_name(path), args)
-    attr1 = getattr(plot1, args.plot)
 
-    show_plot(attr1[0], attr1[1], attr1[2])
+def get_source_names(paths):
+    """
+    Name every source after its last directory. Names that would be the same get their parent directories added,
+    so v1/mod and v2/mod stay apart, and sources with the same path get a number.
+    """
+    parts = [os.path.normpath(os.path.abspath(x)).split(os.sep) for x in paths]
+    depths = [1] * len(paths)
+    while True:
+        names = ["/".join(x[-depth:]) for x, depth in zip(parts, depths)]
+        # Going up only helps when the paths of the sources with the same name aren't all the same
+        duplicates = [
+            i for i, name in enumerate(names)
+            if names.count(name) > parts.count(parts[i]) and depths[i] < len(parts[i])
+        ]
+        if not duplicates:
+            break
+        for i in duplicates:
+            depths[i] += 1
 
+    return [
+        f"{name} ({names[:i].count(name) + 1})" if names.count(name) > 1 else name
+        for i, name in enumerate(names)
+    ]
 
-def handle_file(filepath):
-    global base_modifiers, new_modifiers
-    with open(filepath, "r", encoding="utf-8") as file:
-        lines = file.readlines()
-
-    for i, line in enumerate(lines):
-        modifier = handle_line(line)
-        if modifier:
-            name = modifier[0]
-            banned = False
-            if name in BANNED_LIST:
-                banned = True
-            for j in BANNED_PREFIXES:
-                if j in name:
-                    banned = True
-            if banned:
-                continue
-            if name not in base_modifiers:
-                base_modifiers[name] = [ModifierData(name, modifier[1], filepath, i)]
-            else:
-                base_modifiers[name].append(
-                    ModifierData(name, modifier[1], filepath, i)
-                )
 
+def main(args):
+    paths = args.compare if args.compare else [args.path]
+    sources = get_source_names(paths)
+    found_files = list()
+    file_sources = list()
+    for source_id, path in enumerate(paths):
+        for i in args.dirs:
+            directory = get_analysis_directory(path, i)
+            files = [
+                os.path.join(directory, x)
+                for x in sorted(os.listdir(directory))
+                if x.endswith(".txt")
+            ]
+            found_files += files
+            file_sources += [source_id] * len(files)
 
-def handle_line(line):
-    modifier_found = re.search(
-        r"([A-Za-z_0-9][A-Za-z_0-9]*)\s?=\s?(-?\d+\.?\d?\d?|yes)", line
+    cache = None if args.nocache else ParseCache(args.cache)
+    modifier_filter = (
+        ModifierFilter.from_file(args.filters) if args.filters else ModifierFilter.default()
     )
-    if modifier_found:
-        name = modifier_found.group(1)
-        value = modifier_found.group(2)
-        return (name, value)
-    return False
+    modifier_store = scan_files(
+        found_files, args.jobs, cache, sources, file_sources, modifier_filter
+    )
+    if cache is not None:
+        cache.close()
 
+    if len(sources) > 1:
+        print_table(
+            *get_modifier_table(modifier_store, args.filterby, args.min, args.max)
+        )
+
+    if args.sourceindex:
+        write_source_index(
+            args.sourceindex, modifier_store, args.filterby, args.min, args.max
+        )
+
+    out_format = os.path.splitext(args.out)[1].lower() if args.out else None
+    if out_format in TABLE_FORMATS:
+        write_table(
+            args.out,
+            *get_modifier_table(modifier_store, args.filterby, args.min, args.max),
+        )
+        return
+
+    fig = get_figure(modifier_store, args)
+    if out_format == ".html":
+        fig.write_html(args.out, include_plotlyjs=True)
+    else:
+        fig.show()
+
+
+def get_figure(modifier_store, args):
+    """Build the figure of the requested plot type, with a trace for every source."""
+    title = " vs ".join(get_plot_title(x) for x in modifier_store.sources)
+    traces = [
+        getattr(Plots(modifier_store, title, args, i), args.plot)()
+        for i in range(len(modifier_store.sources))
+    ]
+    layout_kwargs = traces[0][2]
+    if len(traces) > 1:
+        for Plot, kwargs, _ in traces:
+            if "marker" in kwargs:
+                # Every source gets its own trace color instead of the value based bubble colors
+                kwargs["marker"].pop("color", None)
+                kwargs["marker"]["opacity"] = 0.6
+        if args.plot == "Vbar":
+            layout_kwargs["barmode"] = "group"
 
-def show_plot(Plot: type, kwargs: Dict[Any, Any], layout_kwargs):
     fig = go.Figure()
-    fig.add_trace(Plot(**kwargs))
+    for Plot, kwargs, _ in traces:
+        fig.add_trace(Plot(**kwargs))
     fig.update_layout(**layout_kwargs)
-    fig.show()
+    return fig
+
+
+def write_source_index(filename, modifier_store, filter_by, minimum, maximum):
+    """
+    Write every occurrence of the modifiers that pass the filter to a json file.
+    This is the full version of the truncated source lists shown when hovering over the plot.
+    """
+    index = dict()
+    for name_id in get_filtered_ids(modifier_store, filter_by, minimum, maximum):
+        occurrences = dict()
+        for source_id, source in enumerate(modifier_store.sources):
+            rows = modifier_store.get_source_rows(name_id, source_id)
+            if len(rows):
+                occurrences[source] = [
+                    (file, line, float(f"{value:g}"))
+                    for file, line, value in modifier_store.get_occurrences(rows)
+                ]
+        index[modifier_store.names[name_id]] = occurrences
+    with open(filename, "w", encoding="utf-8") as file:
+        json.dump(index, file)
+
+
+def write_table(filename, columns, rows):
+    """Write the modifier table to a csv, json or parquet file depending on the extension of filename."""
+    out_format = os.path.splitext(filename)[1].lower()
+    if out_format == ".csv":
+        with open(filename, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            writer.writerows(rows)
+    elif out_format == ".json":
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump([dict(zip(columns, x)) for x in rows], file, indent=1)
+    elif out_format == ".parquet":
+        try:
+            import pandas as pd
+        except ImportError:
+            raise RuntimeError("Writing parquet files requires pandas and pyarrow")
+        pd.DataFrame(rows, columns=columns).to_parquet(filename, index=False)
+
+
+def get_analysis_directory(path, directory):
+    # Analysis directories are written with windows separators, normalize them for the current platform
+    return os.path.join(path, os.path.normpath(directory.replace("\\", "/")))
+
+
+def scan_files(
+    files, jobs=1, cache=None, sources=None, file_sources=None, modifier_filter=None
+) -> ModifierStore:
+    """
+    Parse every file and merge the results into a ModifierStore.
+    Files that didn't change since they were stored in the cache are not parsed again.
+    With more than 1 job the files are parsed in a process pool, results are always merged in the order of files
+    so the output is identical to a serial run.
+    """
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    results = dict()
+    stale = list()
+    stats = dict()
+    for filepath in files:
+        found = None
+        if cache is not None:
+            # Taken before the file is parsed, the entry is stored with this stat
+            stats[filepath] = os.stat(filepath)
+            found = cache.get(filepath, stats[filepath])
+        if found is None:
+            stale.append(filepath)
+        else:
+            results[filepath] = found
+
+    if jobs > 1 and len(stale) > 1:
+        chunksize = max(1, len(stale) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            parsed = list(executor.map(handle_file, stale, chunksize=chunksize))
+    else:
+        parsed = [handle_file(x) for x in stale]
+    results.update(zip(stale, parsed))
+
+    if cache is not None:
+        cache.put(((x, stats[x], y) for x, y in zip(stale, parsed)), files)
+
+    if sources is None:
+        sources = ["mod"]
+        file_sources = [0] * len(files)
+    if modifier_filter is None:
+        modifier_filter = ModifierFilter.default()
+    modifier_store = ModifierStore(files, sources, file_sources, modifier_filter)
+    for file_id, filepath in enumerate(files):
+        modifier_store.add_file(file_id, results[filepath])
+    modifier_store.finalize()
+    return modifier_store
+
+
+def handle_file(filepath):
+    """
+    Parse a single file and return its (name, value, line) modifiers.
+    Doesn't touch any global state so it can run in a worker process.
+    """
+    with open(filepath, "r", encoding="utf-8-sig") as file:
+        text = file.read()
+    return parse_modifiers(text)
+
+
+def parse_modifiers(text):
+    """
+    Scan a script file once and return every `name = value` pair that sits directly inside a modifier block.
+    Blocks are matched by brace depth, so weights like `ai_will_do = { modifier = { factor = 0 } }` are skipped
+    and only the text directly inside modifier blocks is searched for assignments.
+    Returns a list of (name, value, line) tuples.
+    """
+    if MODIFIER_WORD not in text:
+        return []
+
+    # Strings are emptied and comments removed without touching line breaks so line numbers stay correct
+    if '"' in text:
+        text = STRING_RE.sub('""', text)
+    if "#" in text:
+        text = COMMENT_RE.sub("", text)
+
+    found = list()
+    line = 1
+    line_pos = 0
+    pos = 0
+
+    for start, key, block_end in find_blocks(text):
+        # Blocks inside an excluded or modifier block that was already handled
+        if start < pos:
+            continue
+        pos = block_end
+
+        if key in EXCLUDED_BLOCKS:
+            pos = get_block_end(text, pos)
+            continue
+
+        segments = get_block_segments(text, pos)
+        pos = segments[-1][1]
+        for segment_start, segment_end in segments:
+            for assignment in ASSIGNMENT_RE.finditer(text, segment_start, segment_end):
+                name_pos = assignment.start()
+                line += text.count("\n", line_pos, name_pos)
+                line_pos = name_pos
+                found.append((assignment.group(1), assignment.group(2), line))
+
+    return found
+
+
+def find_blocks(text):
+    """
+    Returns the (start, key, end) of every modifier or excluded block in text in file order, end is the position after the `{`.
+    Block keys are found with str.find, which is a lot faster than a regex that stops at every `=` in the file.
+    Excluded blocks after the last modifier block can't hide anything, so they aren't searched for.
+    """
+    blocks = find_keys(text, MODIFIER_BLOCKS, len(text))
+    if not blocks:
+        return blocks
+    blocks += find_keys(text, EXCLUDED_BLOCKS, max(x[0] for x in blocks))
+    blocks.sort()
+    return blocks
+
+
+def find_keys(text, keys, end):
+    """Returns the (start, key, end) of the blocks with any of the keys that start before end."""
+    blocks = list()
+    match_block = BLOCK_RE.match
+    for key in keys:
+        length = len(key)
+        start = text.find(key, 0, end)
+        while start != -1:
+            if start == 0 or text[start - 1] in KEY_SEPARATORS:
+                block = match_block(text, start + length)
+                if block is not None:
+                    blocks.append((start, key, block.end()))
+            start = text.find(key, start + length, end)
+    return blocks
+
+
+def get_block_end(text, pos):
+    """Get the position of the brace that closes the block opened just before pos."""
+    depth = 1
+    while True:
+        end = text.find("}", pos)
+        if end == -1:
+            return len(text)
+        depth += text.count("{", pos, end) - 1
+        if depth == 0:
+            return end
+        pos = end + 1
+
+
+def get_block_segments(text, pos):
+    """
+    Get the (start, end) spans of the text directly inside the block opened just before pos, leaving out nested blocks.
+    The end of the last span is the position of the closing brace.
+    """
+    end = text.find("}", pos)
+    if end == -1:
+        return [(pos, len(text))]
+    if text.find("{", pos, end) == -1:
+        return [(pos, end)]
+
+    segments = list()
+    depth = 1
+    for brace in BRACE_RE.finditer(text, pos):
+        if brace.group() == "{":
+            if depth == 1:
+                segments.append((pos, brace.start()))
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                pos = brace.end()
+            elif depth == 0:
+                segments.append((pos, brace.start()))
+                return segments
+    segments.append((pos, len(text)))
+    return segments
 
 
 def is_valid_directory(parser, arg):
@@ -323,6 +964,18 @@ def is_valid_directory(parser, arg):
     return arg
 
 
+def is_valid_file(parser, arg):
+    if not os.path.isfile(arg):
+        parser.error(f"The file {arg} does not exist!")
+    return arg
+
+
+def is_valid_output_file(parser, arg):
+    if os.path.splitext(arg)[1].lower() not in TABLE_FORMATS | {".html"}:
+        parser.error(f"{arg} is not a .csv, .json, .parquet or .html file!")
+    return arg
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="A simple command-line program to compare Imperator Rome modifier values for comparative analysis."
@@ -331,7 +984,12 @@ if __name__ == "__main__":
         "-path",
         help="The path to the game/mod directory.",
         type=lambda x: is_valid_directory(parser, x),
-        required=True,
+    )
+    parser.add_argument(
+        "-compare",
+        type=lambda x: is_valid_directory(parser, x),
+        nargs="+",
+        help="The paths to several game/mod directories to compare. Replaces -path.",
     )
     parser.add_argument(
         "-dirs",
@@ -368,17 +1026,51 @@ if __name__ == "__main__":
         help="The minimum value to display on the plot.",
         default=10,
     )
+    parser.add_argument(
+        "-jobs",
+        help="The number of processes used to scan files. 0 uses every core.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-cache",
+        help="The file parse results are cached in. Only files that changed since the last run are parsed again.",
+        default=DEFAULT_CACHE_FILE,
+    )
+    parser.add_argument(
+        "-nocache",
+        help="Parse every file without reading or writing the cache.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-out",
+        help="Write the results to a .csv, .json, .parquet or .html file instead of opening the plot in a browser.",
+        type=lambda x: is_valid_output_file(parser, x),
+    )
+    parser.add_argument(
+        "-hoverlimit",
+        help="The maximum number of sources listed when hovering over a modifier. 0 lists all of them.",
+        type=int,
+        default=20,
+    )
+    parser.add_argument(
+        "-sourceindex",
+        help="A .json file to write every source of every modifier to.",
+    )
+    parser.add_argument(
+        "-filters",
+        help="A file with rules for modifier names to leave out, replaces the built in rules.",
+        type=lambda x: is_valid_file(parser, x),
+    )
     args = parser.parse_args()
 
-    
-    for i in args.dirs:
-        if not i.endswith("\\"):
-            i += "\\"
-        path = args.path
-        if not path.endswith("\\"):
-            path += "\\"
-        directory = path + i
-        if not os.path.isdir(directory):
-            parser.error(f"The directory {directory} does not exist!")
+    if args.path is None and not args.compare:
+        parser.error("Either -path or -compare is required!")
+
+    for path in args.compare if args.compare else [args.path]:
+        for i in args.dirs:
+            directory = get_analysis_directory(path, i)
+            if not os.path.isdir(directory):
+                parser.error(f"The directory {directory} does not exist!")
 
     main(args)
@@ -0,0 +1,248 @@
+import os
+import re
+import json
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+"""
+    On-disk index of every province in the setup/provinces folder, used by check_province_setup and default_map_manager.
+    Each province is stored with its id, source file, line and field values (without quotes), so scripts can query
+    provinces by terrain, culture, religion and so on instead of re-parsing every setup file.
+    Files are only parsed again when their mtime or size changes.
+
+    Usage: python province_index.py -path "path/to/your/mod/setup/provinces" -terrain impassable_terrain
+"""
+
+INDEX_VERSION = 3
+DEFAULT_INDEX_FILE = "province_index.sqlite"
+
+PROVINCE_RE = re.compile(r"(\d+)\s*=\s*\{(.+?)\n\}", re.DOTALL)
+FIELD_RE = re.compile(r"(.+?)\s?=\s?(.+)")
+# Quoted strings are matched first so a # inside a string doesn't start a comment
+STRING_OR_COMMENT_RE = re.compile(r'"(?:[^"\\\n]|\\.)*"?|#')
+
+# The fields that get their own column in the index, every field is also stored in the data column
+FIELDS = ("terrain", "culture", "religion", "trade_goods", "civilization_value", "barbarian_power", "province_rank")
+SEA_TERRAINS = ("ocean", "coastal_terrain", "riverine_terrain")
+
+
+class Province(NamedTuple):
+    id: int
+    file: str
+    line: int
+    terrain: str
+    culture: str
+    religion: str
+    trade_goods: str
+    civilization_value: str
+    barbarian_power: str
+    province_rank: str
+    # field -> (value, line) for every field in the province
+    data: dict
+
+
+class ProvinceIndex:
+    """
+    sqlite index of the provinces in a set of setup files.
+    The index mirrors the files passed to update, provinces from files that aren't passed anymore are removed.
+    """
+
+    def __init__(self, filename: str = DEFAULT_INDEX_FILE):
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        version = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        if version is None or version[0] != str(INDEX_VERSION):
+            self.connection.execute("DROP TABLE IF EXISTS files")
+            self.connection.execute("DROP TABLE IF EXISTS provinces")
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),)
+            )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER)"
+        )
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS provinces (id INTEGER, file TEXT, line INTEGER, {', '.join(f'{x} TEXT' for x in FIELDS)}, data TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS provinces_file ON provinces (file)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS provinces_terrain ON provinces (terrain)")
+        self.connection.commit()
+
+    def update(self, files, jobs=1):
+        """Parse every file that changed since the last update, returns the number of parsed files."""
+        known = {
+            path: (mtime, size)
+            for path, mtime, size in self.connection.execute("SELECT path, mtime, size FROM files")
+        }
+        paths = [os.path.abspath(x) for x in files]
+
+        changed = list()
+        for path in paths:
+            stat = os.stat(path)
+            if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                changed.append((path, stat.st_mtime_ns, stat.st_size))
+
+        removed = [(x,) for x in set(known) - set(paths)]
+        if not changed and not removed:
+            return 0
+
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+
+        if jobs > 1 and len(changed) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(parse_file, [x[0] for x in changed], chunksize=8))
+        else:
+            results = [parse_file(x[0]) for x in changed]
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM provinces WHERE file = ?", removed + [(x[0],) for x in changed])
+            self.connection.executemany("DELETE FROM files WHERE path = ?", removed)
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", changed)
+            for rows in results:
+                self.connection.executemany(
+                    f"INSERT INTO provinces VALUES ({', '.join('?' * (len(FIELDS) + 4))})", rows
+                )
+        return len(changed)
+
+    def get_provinces(self, where="", params=()):
+        """Returns the provinces matching an sql condition, in file and line order."""
+        query = "SELECT * FROM provinces"
+        if where:
+            query += f" WHERE {where}"
+        query += " ORDER BY file, line"
+        return [
+            Province(*row[:-1], json.loads(row[-1]))
+            for row in self.connection.execute(query, params)
+        ]
+
+    def get_ids(self, terrains):
+        """Returns the ids of the provinces with any of the terrains, grouped by file."""
+        ids = dict()
+        for pid, file in self.connection.execute(
+            f"SELECT id, file FROM provinces WHERE terrain IN ({', '.join('?' * len(terrains))}) ORDER BY file, line",
+            tuple(terrains),
+        ):
+            ids.setdefault(file, list()).append(pid)
+        return ids
+
+    def get_sorted_ids(self, terrains):
+        """Returns the sorted and deduplicated ids of the provinces with any of the terrains."""
+        return [
+            x[0] for x in self.connection.execute(
+                f"SELECT DISTINCT id FROM provinces WHERE terrain IN ({', '.join('?' * len(terrains))}) ORDER BY id",
+                tuple(terrains),
+            )
+        ]
+
+    def close(self):
+        self.connection.close()
+
+
+def split_comment(line):
+    """
+    Returns the code and the comment of a line, # inside quoted strings doesn't start a comment.
+
+    >>> split_comment('name="A #1 place" # a comment')
+    ('name="A #1 place" ', '# a comment')
+    """
+    for match in STRING_OR_COMMENT_RE.finditer(line):
+        if match.group() == "#":
+            return line[:match.start()], line[match.start():]
+    return line, ""
+
+
+def strip_strings(code):
+    # Braces inside quoted strings don't open or close blocks
+    return STRING_OR_COMMENT_RE.sub('""', code)
+
+
+def parse_fields(body, line=1):
+    """
+    Returns field -> (value, line, comment) for the key=value lines at the top level of a province body,
+    and the (index, text) of every other line. Blocks like pops={ ... } and everything inside them are not fields.
+    The comment is the trailing comment of the field's line, or an empty string.
+
+    >>> fields, _ = parse_fields('\\n\\tname="A #1 place"\\n\\tterrain="ocean" # keep as ocean\\n')
+    >>> fields["name"]
+    ('"A #1 place"', 2, '')
+    >>> fields["terrain"]
+    ('"ocean"', 3, '# keep as ocean')
+    """
+    fields = dict()
+    other = list()
+    depth = 0
+    for i, body_line in enumerate(body.split("\n")):
+        code, comment = split_comment(body_line)
+        bare = strip_strings(code)
+        field = FIELD_RE.match(code) if depth == 0 else None
+        if field and "{" not in strip_strings(field.group(2)):
+            fields[field.group(1).strip()] = (field.group(2).strip(), line + i, comment)
+        else:
+            other.append((i, body_line))
+        depth += bare.count("{") - bare.count("}")
+    return fields, other
+
+
+def parse_file(filename):
+    """Returns the index rows of every province in a setup file."""
+    with open(filename, 'r', encoding="utf-8-sig") as file:
+        text = file.read()
+
+    rows = list()
+    line = 1
+    pos = 0
+    for match in PROVINCE_RE.finditer(text):
+        line += text.count("\n", pos, match.start())
+        pos = match.start()
+        # The body starts on the same line as the province id
+        fields, _ = parse_fields(match.group(2), line)
+        data = {key: (value.strip('"'), field_line) for key, (value, field_line, _) in fields.items()}
+
+        rows.append(
+            (int(match.group(1)), filename, line)
+            + tuple(data[x][0] if x in data else None for x in FIELDS)
+            + (json.dumps(data),)
+        )
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build an index of the provinces in the Imperator Rome setup files and query it.")
+    parser.add_argument(
+        "-path",
+        help="The path to the setup/provinces folder.",
+        required=True,
+    )
+    parser.add_argument(
+        "-index",
+        help="The sqlite file the index is stored in.",
+        default=DEFAULT_INDEX_FILE,
+    )
+    parser.add_argument(
+        "-jobs",
+        help="The number of processes used to parse changed files. 0 uses every core.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-terrain",
+        help="Print the ids of the provinces with any of these terrains.",
+        nargs="+",
+        default=[],
+    )
+    args = parser.parse_args()
+
+    index = ProvinceIndex(args.index)
+    files = [os.path.join(args.path, x) for x in sorted(os.listdir(args.path)) if x.endswith(".txt")]
+    print(f"Parsed {index.update(files, args.jobs)} of {len(files)} files")
+    if args.terrain:
+        for file, ids in index.get_ids(args.terrain).items():
+            print(f"{os.path.basename(file)}: {' '.join(str(x) for x in ids)}")
+    index.close()